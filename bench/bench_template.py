@@ -0,0 +1,171 @@
+"""
+Template generation benchmarks
+
+Every case runs in a fresh interpreter so the troposphere/awacs import is measured cold. Results are
+written as JSON and can be compared against an earlier run with --baseline:
+
+    python bench/bench_template.py -o bench.json
+    python bench/bench_template.py -o bench-new.json --baseline bench.json
+
+Cases
+ - current: the template as built for config.json
+ - synthetic: the template scaled up to more listener rules, AZs and services (templates per process)
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+TROPO_DIR = os.path.join(ROOT, "tropo")
+
+CASES = [
+    {"name": "current", "listener_rules": 1, "azs": 3, "services": 1},
+    {"name": "rules-50", "listener_rules": 50, "azs": 3, "services": 1},
+    {"name": "azs-6", "listener_rules": 1, "azs": 6, "services": 1},
+    {"name": "services-25", "listener_rules": 1, "azs": 3, "services": 25},
+    {"name": "large", "listener_rules": 50, "azs": 6, "services": 25},
+]
+
+# Lower is better for all of these
+METRICS = ["import_seconds", "build_seconds", "serialize_seconds", "peak_rss_kb", "output_bytes"]
+
+
+def scale_template(template, listener_rules):
+    """
+    Add copies of ListenerRule1 until the template has the requested number
+    """
+    rule = template.resources["ListenerRule1"]
+    for i in range(2, listener_rules + 1):
+        copy = type(rule)("ListenerRuleSynthetic%d" % i, **dict(rule.properties))
+        copy.Priority = 1000 + i
+        template.add_resource(copy)
+
+
+def spread_config(config, azs):
+    """
+    Config with the AZs A, B, ... and the scheduled capacities rounded up to spread evenly over them
+    """
+    def spread(entry):
+        minimum = -(-int(entry["MinCapacity"]) // azs) * azs
+        return dict(entry, MinCapacity=minimum, MaxCapacity=max(minimum, int(entry["MaxCapacity"])))
+
+    config = dict(config, AvailabilityZones=[chr(ord("A") + i) for i in range(azs)])
+    config["Schedule"] = dict((env, [spread(entry) for entry in entries])
+                              for env, entries in config.get("Schedule", {}).items())
+    return config
+
+
+def run_case(case):
+    """
+    Runs inside the worker interpreter, returns the measurements of one case
+    """
+    import resource
+
+    start = time.perf_counter()
+    sys.path.insert(0, TROPO_DIR)
+    from service_hello_world import build_template, load_config
+    import_seconds = time.perf_counter() - start
+
+    config = spread_config(load_config(os.path.join(ROOT, "config.json")), case["azs"])
+    build_seconds = 0.0
+    serialize_seconds = 0.0
+    output_bytes = 0
+    for _ in range(case["services"]):
+        start = time.perf_counter()
+        template = build_template(config)
+        scale_template(template, case["listener_rules"])
+        build_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        body = template.to_json()
+        serialize_seconds += time.perf_counter() - start
+        output_bytes += len(body.encode("utf-8"))
+
+    return {
+        "import_seconds": import_seconds,
+        "build_seconds": build_seconds,
+        "serialize_seconds": serialize_seconds,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "output_bytes": output_bytes,
+        "resources": len(template.resources),
+    }
+
+
+def measure(case, repeat):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(case)])
+        runs.append(json.loads(output.decode("utf-8")))
+    # The minimum is the least noisy estimate on a shared box
+    result = {metric: min(run[metric] for run in runs) for metric in METRICS}
+    result["resources"] = runs[0]["resources"]
+    result["runs"] = runs
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the regressions of results against baseline, metrics worse by more than tolerance (a fraction)
+    """
+    regressions = []
+    for name, result in results["cases"].items():
+        previous = baseline.get("cases", {}).get(name)
+        if not previous:
+            continue
+        for metric in METRICS:
+            if previous[metric] and result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append("%s %s: %.6g -> %.6g" % (name, metric, previous[metric], result[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark template generation")
+    parser.add_argument("-o", "--output", default="bench.json", help="Result file")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Fresh interpreter runs per case")
+    parser.add_argument("-c", "--case", action="append", help="Only run the named case(s)")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown/growth, 0.2 is 20%%")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_case(json.loads(args.worker))))
+        return 0
+
+    import troposphere
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "troposphere": troposphere.__version__,
+        "cases": {},
+    }
+    for case in CASES:
+        if args.case and case["name"] not in args.case:
+            continue
+        result = measure(case, args.repeat)
+        result["case"] = case
+        results["cases"][case["name"]] = result
+        print("%-12s import %.3fs build %.3fs serialize %.3fs rss %d KB output %d bytes" % (
+            case["name"], result["import_seconds"], result["build_seconds"], result["serialize_seconds"],
+            result["peak_rss_kb"], result["output_bytes"]), file=sys.stderr)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,437 @@
+"""
+Load test of the service's content
+
+An asyncio load generator with closed-loop virtual users. Without a target it serves --docroot (src/ by
+default) with a local HTTP/1.1 server, --image runs an image like the build does and --url tests a
+running server. Nothing leaves the box:
+
+    python bench/load_test.py -o loadtest.json
+    python bench/load_test.py --image <image> -o loadtest.json --baseline loadtest-previous.json
+    python bench/load_test.py --url http://127.0.0.1:8080 -s mix-keepalive -s soak --duration 300
+
+The requests come from the page: a page view is the page followed by the images, stylesheets and
+scripts it references (the first source of a <picture>), one after the other on the user's connection.
+
+Scenarios
+ - page-keepalive: only the page, over keep-alive connections
+ - mix-keepalive: page views over keep-alive connections
+ - mix-new-connections: page views with a new connection per request (Connection: close)
+ - ramp: page views, the users rising linearly to --users over the run
+ - step: page views, the users rising to --users in --steps equal steps
+ - soak: page views at --users for a longer run, see the timeline for drift (not run by default)
+
+Latency is measured from sending the request, or from connecting for a new connection, to the last byte
+of the body. The generator is a single process: when client_cpu_percent is near 100 the client, not the
+server, is the bottleneck. Exits 1 when a request failed or, with --baseline, on a regression.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from html.parser import HTMLParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SCENARIOS = [
+    {"name": "page-keepalive", "mix": "page", "keepalive": True, "profile": "constant", "duration": 10},
+    {"name": "mix-keepalive", "mix": "page-view", "keepalive": True, "profile": "constant", "duration": 10},
+    {"name": "mix-new-connections", "mix": "page-view", "keepalive": False, "profile": "constant", "duration": 10},
+    {"name": "ramp", "mix": "page-view", "keepalive": True, "profile": "ramp", "duration": 20},
+    {"name": "step", "mix": "page-view", "keepalive": True, "profile": "step", "duration": 20},
+    {"name": "soak", "mix": "page-view", "keepalive": True, "profile": "soak", "duration": 120},
+]
+DEFAULT_SCENARIOS = ["page-keepalive", "mix-keepalive", "mix-new-connections", "ramp", "step"]
+
+PERCENTILES = [("p50", 50), ("p90", 90), ("p99", 99), ("p999", 99.9)]
+
+# Lower is better for all of these, throughput_rps is compared the other way round
+METRICS = ["latency_p50_ms", "latency_p90_ms", "latency_p99_ms", "latency_p999_ms"]
+
+
+class ReferenceParser(HTMLParser):
+    """
+    Same origin references of a page a browser would fetch: img/script src, stylesheet and icon links and
+    the largest candidate of the first <source> of a <picture> instead of its <img>
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.references = []
+        self.picture = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "picture":
+            self.picture = "open"
+        elif tag == "source" and self.picture == "open" and attrs.get("srcset"):
+            self.references.append(attrs["srcset"].split(",")[-1].split()[0])
+            self.picture = "fetched"
+        elif tag == "img" and self.picture != "fetched" and attrs.get("src"):
+            self.references.append(attrs["src"])
+        elif tag == "script" and attrs.get("src"):
+            self.references.append(attrs["src"])
+        elif tag == "link" and attrs.get("href") and set((attrs.get("rel") or "").lower().split()) & {
+                "stylesheet", "icon", "preload"}:
+            self.references.append(attrs["href"])
+
+    def handle_endtag(self, tag):
+        if tag == "picture":
+            self.picture = None
+
+
+def page_view(base_url, page):
+    """
+    The page followed by the paths of its same origin references
+    """
+    html = urllib.request.urlopen(urllib.parse.urljoin(base_url, page), timeout=10).read().decode("utf-8")
+    parser = ReferenceParser()
+    parser.feed(html)
+    paths = [page]
+    for reference in parser.references:
+        url = urllib.parse.urlsplit(urllib.parse.urljoin(page, reference))
+        path = url.path + ("?" + url.query if url.query else "")
+        if not url.scheme and not url.netloc and path not in paths:
+            paths.append(path)
+    return paths
+
+
+def target_users(scenario, users, steps, elapsed):
+    """
+    Number of users the profile runs at elapsed seconds into the scenario
+    """
+    progress = min(1.0, elapsed / scenario["duration"])
+    if scenario["profile"] == "ramp":
+        return max(1, int(math.ceil(users * progress)))
+    if scenario["profile"] == "step":
+        return max(1, int(users * min(steps, int(progress * steps) + 1) / steps))
+    return users
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of sorted values, p in 0-100
+    """
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+async def read_response(reader):
+    """
+    Status, body length and whether the server keeps the connection open
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by the server")
+    version, status = status_line.decode("latin-1").split()[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = 0
+    if "content-length" in headers:
+        length = len(await reader.readexactly(int(headers["content-length"])))
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            length += len(await reader.readexactly(size))
+            await reader.readline()
+            if not size:
+                break
+    else:
+        length = len(await reader.read())
+        headers["connection"] = "close"
+    keepalive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+    return int(status), length, keepalive
+
+
+class LoadTest(object):
+    def __init__(self, host, port, paths, scenario, timeout):
+        self.host = host
+        self.port = port
+        self.paths = paths
+        self.scenario = scenario
+        self.timeout = timeout
+        self.start = None
+        # (seconds since the start, latency in seconds, error or None, body bytes)
+        self.samples = []
+
+    def request(self, path):
+        return ("GET %s HTTP/1.1\r\nHost: %s:%d\r\nUser-Agent: load_test\r\nAccept-Encoding: br, gzip\r\n"
+                "Connection: %s\r\n\r\n" % (path, self.host, self.port,
+                                            "keep-alive" if self.scenario["keepalive"] else "close")
+                ).encode("latin-1")
+
+    async def fetch(self, connection, path):
+        """
+        Status and body length of path, and the connection when it stays open, else None
+        """
+        if connection is None:
+            connection = await asyncio.open_connection(self.host, self.port)
+        reader, writer = connection
+        try:
+            writer.write(self.request(path))
+            await writer.drain()
+            status, length, keepalive = await read_response(reader)
+        except BaseException:
+            # Errors, timeouts and the cancellation at the end of the scenario
+            writer.close()
+            raise
+        if not keepalive or not self.scenario["keepalive"]:
+            writer.close()
+            connection = None
+        return connection, status, length
+
+    async def user(self, stopping):
+        connection = None
+        try:
+            while not stopping.is_set():
+                for path in self.paths:
+                    if stopping.is_set():
+                        break
+                    start = time.perf_counter()
+                    error = None
+                    length = 0
+                    try:
+                        connection, status, length = await asyncio.wait_for(
+                            self.fetch(connection, path), self.timeout)
+                        if status >= 400:
+                            error = "status %d" % status
+                    except asyncio.TimeoutError:
+                        error = "timeout"
+                        connection = None
+                    except (OSError, EOFError, ValueError) as e:
+                        error = type(e).__name__
+                        connection = None
+                    self.samples.append((start - self.start, time.perf_counter() - start, error, length))
+                    if error:
+                        # Start over with the page, after a pause so a refusing server is not hammered
+                        await asyncio.sleep(0.1)
+                        break
+        finally:
+            if connection is not None:
+                connection[1].close()
+
+    async def run(self, users, steps):
+        self.start = time.perf_counter()
+        running = []
+        while True:
+            elapsed = time.perf_counter() - self.start
+            if elapsed >= self.scenario["duration"]:
+                break
+            wanted = target_users(self.scenario, users, steps, elapsed)
+            while len(running) < wanted:
+                stopping = asyncio.Event()
+                running.append((asyncio.ensure_future(self.user(stopping)), stopping))
+            while len(running) > wanted:
+                running.pop()[1].set()
+            await asyncio.sleep(0.1)
+        # Requests still in flight at the end are not counted. wait_for can swallow a cancellation that
+        # races with the request completing, the stop event ends those users
+        for task, stopping in running:
+            stopping.set()
+            task.cancel()
+        await asyncio.gather(*[task for task, _ in running], return_exceptions=True)
+        return time.perf_counter() - self.start
+
+
+def summarize(samples, elapsed):
+    completed = [sample for sample in samples if sample[0] + sample[1] <= elapsed]
+    latencies = sorted(sample[1] * 1000 for sample in completed if not sample[2])
+    errors = Counter(sample[2] for sample in completed if sample[2])
+
+    timeline = defaultdict(list)
+    for sample in completed:
+        timeline[int(sample[0])].append(sample)
+    result = {
+        "requests": len(completed),
+        "errors": sum(errors.values()),
+        "error_counts": dict(errors),
+        "throughput_rps": len(latencies) / elapsed,
+        "bytes": sum(sample[3] for sample in completed),
+        "latency_mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "latency_max_ms": latencies[-1] if latencies else None,
+        "timeline": [
+            {
+                "second": second,
+                "requests": len(timeline[second]),
+                "errors": sum(1 for sample in timeline[second] if sample[2]),
+                "latency_p99_ms": percentile(sorted(sample[1] * 1000 for sample in timeline[second]), 99),
+            }
+            for second in sorted(timeline)
+        ],
+    }
+    for name, p in PERCENTILES:
+        result["latency_%s_ms" % name] = percentile(latencies, p) if latencies else None
+    return result
+
+
+def run_scenario(base_url, paths, scenario, users, steps, timeout):
+    url = urllib.parse.urlsplit(base_url)
+    test = LoadTest(url.hostname, url.port or 80, paths, scenario, timeout)
+    cpu = time.process_time()
+    loop = asyncio.new_event_loop()
+    try:
+        elapsed = loop.run_until_complete(test.run(users, steps))
+    finally:
+        loop.close()
+    result = summarize(test.samples, elapsed)
+    result["client_cpu_percent"] = 100 * (time.process_time() - cpu) / elapsed
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the regressions of results against baseline: latencies higher and throughput lower by more
+    than tolerance (a fraction), and errors where the baseline had none
+    """
+    regressions = []
+    for name, result in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        for metric in METRICS:
+            if previous[metric] and result[metric] and result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append("%s %s: %.6g -> %.6g" % (name, metric, previous[metric], result[metric]))
+        if result["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append("%s throughput_rps: %.6g -> %.6g" % (
+                name, previous["throughput_rps"], result["throughput_rps"]))
+        if result["errors"] and not previous["errors"]:
+            regressions.append("%s errors: 0 -> %d" % (name, result["errors"]))
+    return regressions
+
+
+def serve(docroot):
+    """
+    Runs in the server process: serves docroot over HTTP/1.1 on a free port and prints the port
+    """
+    import functools
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(SimpleHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # The headers and the body are separate writes, with Nagle the body waits for the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 511
+
+        def handle_error(self, request, client_address):
+            # Clients closing their connections at the end of a scenario
+            pass
+
+    server = Server(("127.0.0.1", 0), functools.partial(Handler, directory=docroot))
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+def docker(*args):
+    return subprocess.check_output(("docker",) + args).decode("utf-8").strip()
+
+
+def wait_ready(base_url, path, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(urllib.parse.urljoin(base_url, path), timeout=1).read()
+            return
+        except IOError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the service's content")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--docroot", default=os.path.join(ROOT, "src"), help="Directory to serve locally")
+    target.add_argument("--image", help="Image to run and test")
+    target.add_argument("--url", help="Base URL of a running server")
+    parser.add_argument("-o", "--output", default="loadtest.json", help="Result file")
+    parser.add_argument("-s", "--scenario", action="append", choices=[scenario["name"] for scenario in SCENARIOS],
+                        help="Only run the named scenario(s), default: %s" % ", ".join(DEFAULT_SCENARIOS))
+    parser.add_argument("-u", "--users", type=int, default=20, help="Concurrent users, the peak of ramp and step")
+    parser.add_argument("--steps", type=int, default=4, help="Steps of the step profile")
+    parser.add_argument("--duration", type=float, help="Seconds per scenario, overrides the scenario's")
+    parser.add_argument("--page", default="/", help="Page of a page view")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds before a request is an error")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown, 0.2 is 20%%")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    server = None
+    container = None
+    try:
+        if args.url:
+            base_url = args.url
+        elif args.image:
+            container = docker("run", "-d", "-p", "127.0.0.1::80", args.image)
+            port = int(docker("port", container, "80/tcp").splitlines()[0].rsplit(":", 1)[1])
+            base_url = "http://127.0.0.1:%d" % port
+        else:
+            server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", args.docroot],
+                                      stdout=subprocess.PIPE)
+            base_url = "http://127.0.0.1:%d" % int(server.stdout.readline())
+        wait_ready(base_url, args.page, 30)
+        paths = page_view(base_url, args.page)
+
+        results = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.url or args.image or os.path.relpath(args.docroot, ROOT),
+            "page_view": paths,
+            "users": args.users,
+            "scenarios": {},
+        }
+        for scenario in SCENARIOS:
+            if scenario["name"] not in (args.scenario or DEFAULT_SCENARIOS):
+                continue
+            scenario = dict(scenario, duration=args.duration or scenario["duration"])
+            result = run_scenario(base_url, paths if scenario["mix"] == "page-view" else [args.page],
+                                  scenario, args.users, args.steps, args.timeout)
+            result["scenario"] = scenario
+            results["scenarios"][scenario["name"]] = result
+            print("%-20s %8.1f req/s p50 %s p90 %s p99 %s p999 %s ms, %d errors, client CPU %.0f%%" % (
+                scenario["name"], result["throughput_rps"],
+                *["%.2f" % result["latency_%s_ms" % name] if result["latency_%s_ms" % name] is not None else "-"
+                  for name, _ in PERCENTILES],
+                result["errors"], result["client_cpu_percent"]), file=sys.stderr)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if container:
+            subprocess.call(["docker", "rm", "-f", container], stdout=subprocess.DEVNULL)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression, file=sys.stderr)
+    errors = sum(result["errors"] for result in results["scenarios"].values())
+    return 1 if regressions or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,3 +5,4 @@ echo "{\"imagename\": \"${IMAGE_REPO_NAME}\", \"imagetag\": \"${IMAGE_TAG}\"}" >
 cp config.json UAT-config.json
 cp config.json PROD-config.json
 sed -i "s/UAT-/PROD-/g" PROD-config.json
+sed -i "s/\"StackEnv\": \"UAT\"/\"StackEnv\": \"PROD\"/" PROD-config.json
@@ -0,0 +1,421 @@
+"""
+Static asset build, run in the assets stage of the Dockerfile
+
+    python docker/build_assets.py src/ htdocs/ --vendor docker/vendor.json
+
+ - Downloads the third-party files listed in vendor.json and points the HTML at the local copies
+ - Drops the CSS rules of vendored stylesheets that match nothing in the HTML
+ - Writes resized WebP/AVIF/original variants of <img> images and serves them through <picture>/srcset
+ - Renames every asset but HTML to <name>.<content hash>.<ext> and rewrites the references to it
+ - Inlines small stylesheets into the HTML and minifies it
+ - Writes .gz and .br siblings of compressible files, served by docker/httpd/assets.conf
+ - Optionally lists every file for mod_file_cache, see docker/httpd/file_cache.conf
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+HASH_LENGTH = 12
+COMPRESSIBLE = (".html", ".css", ".js", ".svg", ".json", ".txt", ".xml")
+# Not worth a negotiation round for tiny files such as the health check
+MIN_COMPRESS_BYTES = 256
+# Not fingerprinted, their URLs are fixed
+STABLE = ("health/index.html",)
+# Stylesheets up to this size are inlined, they fit in the first round trip with the HTML
+INLINE_CSS_BYTES = 14 * 1024
+# Larger files are kept open and sent with sendfile instead of being mapped into every process
+MMAP_MAX_BYTES = 64 * 1024
+RESPONSIVE_WIDTHS = (480, 960, 1440)
+RESPONSIVE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+REFERENCE = re.compile(r'''((?:src|href)\s*=\s*["'])([^"'#?]+)''', re.IGNORECASE)
+SRCSET = re.compile(r'''(srcset\s*=\s*["'])([^"']+)''', re.IGNORECASE)
+PRESERVE = re.compile(r"(<(pre|textarea|script|style)\b.*?</\2>)", re.IGNORECASE | re.DOTALL)
+COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+IMG = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+ATTRIBUTE = re.compile(r'''([\w-]+)\s*=\s*["']([^"']*)["']''')
+STYLESHEET = re.compile(r'''<link\b[^>]*rel=["']stylesheet["'][^>]*>''', re.IGNORECASE)
+SCRIPT = re.compile(r'''<script\b([^>]*)\bsrc=["']([^"']+)["']([^>]*)>''', re.IGNORECASE)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def fingerprint(path):
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:HASH_LENGTH]
+    root, ext = os.path.splitext(path)
+    return "%s.%s%s" % (root, digest, ext)
+
+
+def html_files(dest):
+    for root, _, names in os.walk(dest):
+        for name in sorted(names):
+            if name.endswith(".html"):
+                yield os.path.join(root, name)
+
+
+def vendor(dest, entries, cache=None, offline=False):
+    """
+    Fetch every vendor.json entry into dest, from cache when it has the file, and verify its sha384
+    """
+    for entry in entries:
+        path = os.path.join(dest, entry["path"])
+        cached = cache and os.path.join(cache, entry["path"])
+        if cached and os.path.exists(cached):
+            with open(cached, "rb") as f:
+                data = f.read()
+        elif offline:
+            raise ValueError("%s is not in the vendor cache %s" % (entry["path"], cache))
+        else:
+            with urllib.request.urlopen(entry["url"], timeout=30) as response:
+                data = response.read()
+        digest = "sha384-" + base64.b64encode(hashlib.sha384(data).digest()).decode("ascii")
+        if "integrity" not in entry:
+            raise ValueError("%s is not pinned, add \"integrity\": \"%s\"" % (entry["url"], digest))
+        if digest != entry["integrity"]:
+            raise ValueError("%s: expected %s, got %s" % (entry["url"], entry["integrity"], digest))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(data)
+
+    urls = {entry["url"]: entry["path"] for entry in entries}
+    for path in html_files(dest):
+        html = read(path)
+        for url, local in urls.items():
+            local = os.path.relpath(os.path.join(dest, local), os.path.dirname(path)).replace(os.sep, "/")
+            html = html.replace('"%s"' % url, '"%s"' % local).replace('"%s"' % url.replace("&", "&amp;"), '"%s"' % local)
+        # Order is kept with defer, and the scripts no longer block the first render
+        html = SCRIPT.sub(
+            lambda m: m.group(0) if re.search(r"\b(defer|async)\b", m.group(0)) or "://" in m.group(2)
+            else "<script%ssrc=\"%s\"%s defer>" % (m.group(1), m.group(2), m.group(3)),
+            html
+        )
+        write(path, html)
+
+
+def selector_names(selector):
+    """
+    Class names, ids and element names a selector needs to match anything
+    """
+    selector = re.sub(r"\[[^\]]*\]", "", selector)
+    selector = re.sub(r":not\([^)]*\)", "", selector)
+    selector = re.sub(r"::?[\w-]+(\([^)]*\))?", "", selector)
+    classes = re.findall(r"\.(-?[_a-zA-Z][\w-]*)", selector)
+    ids = re.findall(r"#(-?[_a-zA-Z][\w-]*)", selector)
+    elements = re.findall(r"(?:^|[\s>+~])([a-zA-Z][\w-]*)", selector)
+    return ["." + name for name in classes] + ["#" + name for name in ids] + [name.lower() for name in elements]
+
+
+def css_blocks(css):
+    """
+    Split CSS into (prelude, body) blocks, statements such as @import come back with a None body
+    """
+    blocks = []
+    i = 0
+    while i < len(css):
+        start = css.find("{", i)
+        if start < 0:
+            break
+        prelude = css[i:start]
+        while ";" in prelude:
+            statement, prelude = prelude.split(";", 1)
+            if statement.strip():
+                blocks.append((statement.strip() + ";", None))
+        depth = 1
+        end = start + 1
+        while depth and end < len(css):
+            depth += {"{": 1, "}": -1}.get(css[end], 0)
+            end += 1
+        blocks.append((prelude.strip(), css[start + 1:end - 1]))
+        i = end
+    return blocks
+
+
+def purge_css(css, used):
+    """
+    Drop the selectors that name a class, id or element missing from used and the rules left without one,
+    then the @font-face and @keyframes nothing refers to any more
+    """
+    def purge(text):
+        out = []
+        for prelude, body in css_blocks(text):
+            if body is None:
+                out.append(prelude)
+            elif prelude.startswith("@media") or prelude.startswith("@supports"):
+                inner = purge(body)
+                if inner:
+                    out.append("%s{%s}" % (prelude, inner))
+            elif prelude.startswith("@"):
+                out.append("%s{%s}" % (prelude, body))
+            else:
+                selectors = [s for s in prelude.split(",") if all(name in used for name in selector_names(s))]
+                if selectors:
+                    out.append("%s{%s}" % (",".join(selectors), body))
+        return "".join(out)
+
+    licenses = "".join(re.findall(r"/\*!.*?\*/", css, re.DOTALL))
+    css = purge(re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL))
+
+    rules = "".join("%s{%s}" % block for block in css_blocks(css) if block[1] is not None
+                    and not block[0].startswith(("@font-face", "@keyframes", "@-webkit-keyframes", "@-o-keyframes")))
+    out = []
+    for prelude, body in css_blocks(css):
+        if prelude.startswith("@font-face"):
+            family = re.search(r"font-family:\s*['\"]?([^;'\"}]+)", body)
+            if family and family.group(1) not in rules:
+                continue
+        elif prelude.startswith(("@keyframes", "@-webkit-keyframes", "@-o-keyframes")):
+            if prelude.split()[-1] not in rules:
+                continue
+        out.append(prelude if body is None else "%s{%s}" % (prelude, body))
+    return licenses + "".join(out)
+
+
+def used_names(dest, safelist):
+    used = set(safelist)
+    for path in html_files(dest):
+        html = read(path)
+        used.update(name.lower() for name in re.findall(r"<([a-zA-Z][\w-]*)", html))
+        for classes in re.findall(r'''class\s*=\s*["']([^"']*)["']''', html):
+            used.update("." + name for name in classes.split())
+        used.update("#" + name for name in re.findall(r'''id\s*=\s*["']([^"']*)["']''', html))
+    return used
+
+
+def responsive_images(dest):
+    """
+    Replace local raster <img> tags with a <picture> offering resized AVIF/WebP/original variants
+    """
+    if Image is None:
+        print("Pillow is not installed, images are served as they are", file=sys.stderr)
+        return
+    formats = [("image/avif", ".avif", "AVIF")] if features.check("avif") else []
+    formats.append(("image/webp", ".webp", "WEBP"))
+
+    def variants(path):
+        image = Image.open(path)
+        root, ext = os.path.splitext(path)
+        widths = sorted(set([w for w in RESPONSIVE_WIDTHS if w < image.width] + [image.width]))
+        out = {ext: []}
+        for width in widths:
+            resized = image if width == image.width else image.resize(
+                (width, image.height * width // image.width), Image.LANCZOS)
+            if width != image.width:
+                name = "%s-%dw%s" % (root, width, ext)
+                resized.save(name, optimize=True)
+                out[ext].append((name, width))
+            for _, suffix, pil_format in formats:
+                name = "%s-%dw%s" % (root, width, suffix)
+                resized.save(name, pil_format)
+                out.setdefault(suffix, []).append((name, width))
+        out[ext].append((path, image.width))
+        # A variant that is not smaller than the original is no use
+        for suffix, files in out.items():
+            for name, width in list(files):
+                if name != path and os.path.getsize(name) >= os.path.getsize(path):
+                    os.remove(name)
+                    files.remove((name, width))
+        return out
+
+    for path in html_files(dest):
+        html_dir = os.path.dirname(path)
+
+        def replace(match):
+            tag = match.group(0)
+            attributes = dict(ATTRIBUTE.findall(tag))
+            src = attributes.get("src", "")
+            image = os.path.normpath(os.path.join(html_dir, src))
+            if "://" in src or not src.lower().endswith(RESPONSIVE_EXTENSIONS) or not os.path.exists(image):
+                return tag
+            width = attributes.get("width", "")
+            sizes = width.replace("%", "vw") if width.endswith("%") else width or "100vw"
+
+            def srcset(files):
+                return ", ".join("%s %dw" % (os.path.relpath(name, html_dir).replace(os.sep, "/"), w) for name, w in files)
+
+            files = variants(image)
+            sources = "".join('<source type="%s" srcset="%s" sizes="%s">' % (mime, srcset(files[suffix]), sizes)
+                              for mime, suffix, _ in formats if files[suffix])
+            attrs = ' srcset="%s" sizes="%s"' % (srcset(files[os.path.splitext(image)[1]]), sizes)
+            if "loading" not in attributes:
+                attrs += ' loading="lazy"'
+            if "decoding" not in attributes:
+                attrs += ' decoding="async"'
+            img = re.sub(r"\s*/?>$", attrs + ">", tag)
+            return "<picture>%s%s</picture>" % (sources, img)
+
+        write(path, IMG.sub(replace, read(path)))
+
+
+def rewrite_references(html, html_dir, renamed):
+    """
+    Point relative src/href/srcset attributes at the fingerprinted names
+    """
+    def local(url):
+        target = os.path.normpath(os.path.join(html_dir, url))
+        if target not in renamed:
+            return url
+        return os.path.relpath(renamed[target], html_dir).replace(os.sep, "/")
+
+    def replace_srcset(match):
+        candidates = []
+        for candidate in match.group(2).split(","):
+            parts = candidate.split()
+            candidates.append(" ".join([local(parts[0])] + parts[1:]))
+        return match.group(1) + ", ".join(candidates)
+
+    html = REFERENCE.sub(lambda match: match.group(1) + local(match.group(2)), html)
+    return SRCSET.sub(replace_srcset, html)
+
+
+def inline_stylesheets(html, html_dir, dest, inlined=None):
+    """
+    Replace links to small local stylesheets with a <style> block
+     - The paths of the inlined stylesheets are added to the inlined set
+    """
+    def replace(match):
+        href = dict(ATTRIBUTE.findall(match.group(0))).get("href", "")
+        path = os.path.normpath(os.path.join(dest, html_dir, href))
+        if "://" in href or not os.path.exists(path) or os.path.getsize(path) > INLINE_CSS_BYTES:
+            return match.group(0)
+        css = read(path)
+        # Relative url()s would resolve against the HTML once inlined
+        if re.search(r"url\(\s*['\"]?(?!data:|https?:|/)", css):
+            return match.group(0)
+        if inlined is not None:
+            inlined.add(path)
+        return "<style>%s</style>" % css
+    return STYLESHEET.sub(replace, html)
+
+
+def minify_html(html):
+    """
+    Conservative minification: drops comments and collapses whitespace outside pre/textarea/script/style
+    """
+    parts = PRESERVE.split(html)
+    out = []
+    # split() yields text, preserved block, tag name, text, ...
+    for i in range(0, len(parts), 3):
+        text = COMMENT.sub("", parts[i])
+        text = re.sub(r"\s+", " ", text)
+        out.append(text)
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+    return "".join(out).strip()
+
+
+def precompress(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_BYTES:
+        return
+    compressed = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli:
+        compressed[".br"] = brotli.compress(data, quality=11)
+    for suffix, body in compressed.items():
+        if len(body) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(body)
+
+
+def file_cache_list(dest, docroot):
+    """
+    MMapFile/CacheFile directives for every file in dest, as served from docroot
+    """
+    lines = []
+    for root, _, names in os.walk(dest):
+        for name in names:
+            path = os.path.join(root, name)
+            directive = "MMapFile" if os.path.getsize(path) <= MMAP_MAX_BYTES else "CacheFile"
+            lines.append('%s "%s"' % (directive, docroot.rstrip("/") + "/" + os.path.relpath(path, dest)))
+    return "".join(line + "\n" for line in sorted(lines, key=lambda line: line.split(" ", 1)[1]))
+
+
+def build(src, dest, vendor_file=None, vendor_cache=None, offline=False):
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    shutil.copytree(src, dest)
+
+    if vendor_file:
+        with open(vendor_file) as f:
+            entries = json.load(f)
+        vendor(dest, entries, vendor_cache, offline)
+        used = used_names(dest, [name for entry in entries for name in entry.get("safelist", [])])
+        for entry in entries:
+            if entry.get("purge"):
+                path = os.path.join(dest, entry["path"])
+                write(path, purge_css(read(path), used))
+
+    responsive_images(dest)
+
+    files = []
+    for root, _, names in os.walk(dest):
+        files.extend(os.path.relpath(os.path.join(root, name), dest) for name in names)
+
+    renamed = {}
+    for name in sorted(files):
+        if name.endswith(".html") or name in STABLE:
+            continue
+        renamed[name] = os.path.relpath(fingerprint(os.path.join(dest, name)), dest)
+        os.rename(os.path.join(dest, name), os.path.join(dest, renamed[name]))
+
+    inlined = set()
+    for name in sorted(files):
+        if not name.endswith(".html"):
+            continue
+        path = os.path.join(dest, name)
+        html = rewrite_references(read(path), os.path.dirname(name), renamed)
+        html = inline_stylesheets(html, os.path.dirname(name), dest, inlined)
+        write(path, minify_html(html))
+    # Every page carries the inlined stylesheets, nothing requests the files any more
+    for path in inlined:
+        os.remove(path)
+
+    for name in sorted(renamed.get(name, name) for name in files):
+        path = os.path.join(dest, name)
+        if name.endswith(COMPRESSIBLE) and os.path.exists(path):
+            precompress(path)
+
+    if not brotli:
+        print("brotli is not installed, only .gz variants were written", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the static assets served by httpd")
+    parser.add_argument("src", help="Source directory, src/")
+    parser.add_argument("dest", help="Output directory, becomes htdocs/")
+    parser.add_argument("--vendor", help="vendor.json with the third-party files to bundle")
+    parser.add_argument("--vendor-cache", help="Directory with already downloaded vendor files, for offline builds")
+    parser.add_argument("--offline", action="store_true", help="Fail instead of downloading files missing from the cache")
+    parser.add_argument("--file-cache", help="Write the mod_file_cache directives for the output to this file")
+    parser.add_argument("--docroot", default="/usr/local/apache2/htdocs", help="Where httpd serves the output from")
+    args = parser.parse_args()
+    build(args.src, args.dest, args.vendor, args.vendor_cache, args.offline)
+    if args.file_cache:
+        write(args.file_cache, file_cache_list(args.dest, args.docroot))
@@ -0,0 +1,159 @@
+"""
+Check that stopping a container drops no requests
+
+Runs the image, keeps --connections keep-alive clients downloading --path with a slow reader, then does
+what ECS does with a deregistered task: no new requests are sent and the container is stopped with
+docker stop while requests are still running. Every request that was started has to complete:
+
+    python docker/drain_test.py <image>
+    python docker/drain_test.py <image> --stop-signal SIGTERM    # httpd's immediate stop, for comparison
+
+Prints the result as JSON and exits 1 when requests were dropped, 2 when no request was in flight at the stop
+and the run proved nothing.
+"""
+import argparse
+import http.client
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+DOCROOT = "/usr/local/apache2/htdocs"
+FILE_CACHE_LIST = "/usr/local/apache2/conf/service/file_cache.list"
+
+
+class SlowConnection(http.client.HTTPConnection):
+    """
+    Connection with a small receive buffer, so a slow reader keeps the response in flight on the server
+    """
+    def connect(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect((self.host, self.port))
+
+
+class Client(threading.Thread):
+    def __init__(self, port, path, read_delay, stopping):
+        super(Client, self).__init__(daemon=True)
+        self.port = port
+        self.path = path
+        self.read_delay = read_delay
+        self.stopping = stopping
+        self.in_flight = False
+        self.completed = 0
+        self.errors = []
+
+    def run(self):
+        connection = SlowConnection("127.0.0.1", self.port, timeout=60)
+        while not self.stopping.is_set():
+            self.in_flight = True
+            try:
+                connection.request("GET", self.path, headers={"Accept-Encoding": "identity"})
+                response = connection.getresponse()
+                length = 0
+                while True:
+                    chunk = response.read(1024)
+                    if not chunk:
+                        break
+                    length += len(chunk)
+                    time.sleep(self.read_delay)
+                if response.status != 200 or length != int(response.getheader("Content-Length", length)):
+                    raise IOError("status %d, %d bytes" % (response.status, length))
+                self.completed += 1
+            except (IOError, http.client.HTTPException) as e:
+                self.errors.append("%s: %s" % (type(e).__name__, e))
+                connection.close()
+            finally:
+                self.in_flight = False
+
+
+def docker(*args):
+    return subprocess.check_output(("docker",) + args).decode("utf-8").strip()
+
+
+def wait_healthy(port, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            urllib.request.urlopen("http://127.0.0.1:%d/health/" % port, timeout=1).read()
+            return
+        except IOError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def largest_cached_file(container):
+    """
+    A file sent with sendfile (CacheFile), the larger files of the image, else the index page
+    """
+    for line in docker("exec", container, "cat", FILE_CACHE_LIST).splitlines():
+        directive, path = line.split(" ", 1)
+        if directive == "CacheFile":
+            return path.strip('"')[len(DOCROOT):]
+    return "/"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that stopping a container drops no requests")
+    parser.add_argument("image", help="Image to test")
+    parser.add_argument("--path", help="Path to download, by default a large file of the image")
+    parser.add_argument("-c", "--connections", type=int, default=20, help="Keep-alive clients")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of load before the stop")
+    parser.add_argument("--read-delay", type=float, default=0.01, help="Seconds a client waits per KB read")
+    parser.add_argument("--drain-timeout", type=int, default=10, help="DRAIN_TIMEOUT, and docker stop -t")
+    parser.add_argument("--stop-signal", help="Override the STOPSIGNAL of the image")
+    args = parser.parse_args(argv)
+
+    run = ["run", "-d", "-p", "127.0.0.1::80", "-e", "DRAIN_TIMEOUT=%d" % args.drain_timeout]
+    if args.stop_signal:
+        run += ["--stop-signal", args.stop_signal]
+    container = docker(*(run + [args.image]))
+    try:
+        port = int(docker("port", container, "80/tcp").splitlines()[0].rsplit(":", 1)[1])
+        wait_healthy(port, 30)
+        path = args.path or largest_cached_file(container)
+
+        stopping = threading.Event()
+        clients = [Client(port, path, args.read_delay, stopping) for _ in range(args.connections)]
+        for client in clients:
+            client.start()
+        time.sleep(args.warmup)
+
+        # The target is deregistered: no new requests, then the stop signal
+        stopping.set()
+        in_flight = sum(client.in_flight for client in clients)
+        start = time.time()
+        docker("stop", "-t", str(args.drain_timeout), container)
+        stop_seconds = time.time() - start
+        for client in clients:
+            client.join(args.drain_timeout + 5)
+    finally:
+        subprocess.call(["docker", "rm", "-f", container], stdout=subprocess.DEVNULL)
+
+    errors = [error for client in clients for error in client.errors]
+    result = {
+        "image": args.image,
+        "path": path,
+        "stop_signal": args.stop_signal or "image",
+        "completed": sum(client.completed for client in clients),
+        "in_flight_at_stop": in_flight,
+        "dropped": len(errors),
+        "errors": sorted(set(errors)),
+        "stop_seconds": round(stop_seconds, 3),
+    }
+    print(json.dumps(result, indent=2, sort_keys=True))
+    if errors:
+        return 1
+    if not in_flight:
+        print("No request was in flight at the stop, raise --connections or --read-delay", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+#!/bin/sh
+# Size the mpm_event worker pool to the container, then start httpd in the foreground.
+#
+# CONTAINER_CPU (CPU units, 1024 is one vCPU) and CONTAINER_MEMORY_RESERVATION (MiB) are set by the task
+# definition from ContainerCpu and ContainerMemoryReservation, docker/httpd/mpm.conf reads the result.
+#  - One process per 256 CPU units, at least 2 so a process can be replaced without a stall
+#  - No more processes than fit in 3/4 of the reservation at HTTPD_PROCESS_MEMORY MiB each
+#  - All processes are started up front and never reaped, the pool does not change under load
+# HTTPD_SERVER_LIMIT overrides the derived process count.
+#
+# Idle keep-alive connections do not hold a worker thread in mpm_event, a process accepts
+# ThreadsPerChild * (AsyncRequestWorkerFactor + 1) connections. The factor is derived from
+#  - the nofile ulimit (NofileLimit in the template), of which a process uses 3/4 for connections
+#  - the last 1/4 of the reservation at HTTPD_CONNECTION_MEMORY KiB per connection
+# and is at least 2, httpd's default. HTTPD_ASYNC_REQUEST_WORKER_FACTOR overrides it.
+#
+# The Dockerfile stops the container with SIGWINCH, httpd's graceful-stop. DRAIN_TIMEOUT is the container's
+# StopTimeout, httpd gives up on the remaining requests 2 seconds before it so it exits before the SIGKILL.
+set -eu
+
+CPU="${CONTAINER_CPU:-200}"
+RESERVATION="${CONTAINER_MEMORY_RESERVATION:-512}"
+THREADS="${HTTPD_THREADS_PER_CHILD:-64}"
+PROCESS_MEMORY="${HTTPD_PROCESS_MEMORY:-24}"
+CONNECTION_MEMORY="${HTTPD_CONNECTION_MEMORY:-32}"
+
+if [ -z "${HTTPD_SERVER_LIMIT:-}" ]; then
+    BY_CPU=$(( (CPU + 255) / 256 ))
+    [ "${BY_CPU}" -lt 2 ] && BY_CPU=2
+    BY_MEMORY=$(( RESERVATION * 3 / 4 / PROCESS_MEMORY ))
+    [ "${BY_MEMORY}" -lt 1 ] && BY_MEMORY=1
+    HTTPD_SERVER_LIMIT=$(( BY_CPU < BY_MEMORY ? BY_CPU : BY_MEMORY ))
+fi
+
+export HTTPD_SERVER_LIMIT
+export HTTPD_THREADS_PER_CHILD="${THREADS}"
+export HTTPD_MAX_REQUEST_WORKERS=$(( HTTPD_SERVER_LIMIT * THREADS ))
+
+if [ -z "${HTTPD_ASYNC_REQUEST_WORKER_FACTOR:-}" ]; then
+    NOFILE=$(ulimit -n)
+    [ "${NOFILE}" = "unlimited" ] && NOFILE=1048576
+    BY_NOFILE=$(( NOFILE * 3 / 4 ))
+    BY_MEMORY=$(( RESERVATION * 1024 / 4 / CONNECTION_MEMORY / HTTPD_SERVER_LIMIT ))
+    PER_PROCESS=$(( BY_NOFILE < BY_MEMORY ? BY_NOFILE : BY_MEMORY ))
+    HTTPD_ASYNC_REQUEST_WORKER_FACTOR=$(( PER_PROCESS / THREADS - 1 ))
+    [ "${HTTPD_ASYNC_REQUEST_WORKER_FACTOR}" -lt 2 ] && HTTPD_ASYNC_REQUEST_WORKER_FACTOR=2
+fi
+export HTTPD_ASYNC_REQUEST_WORKER_FACTOR
+CONNECTIONS=$(( HTTPD_MAX_REQUEST_WORKERS * (HTTPD_ASYNC_REQUEST_WORKER_FACTOR + 1) ))
+
+DRAIN="${DRAIN_TIMEOUT:-30}"
+HTTPD_GRACEFUL_SHUTDOWN_TIMEOUT=$(( DRAIN > 3 ? DRAIN - 2 : 1 ))
+export HTTPD_GRACEFUL_SHUTDOWN_TIMEOUT
+
+echo "mpm_event: ${HTTPD_SERVER_LIMIT} processes x ${THREADS} threads for ${CPU} CPU units, ${RESERVATION} MiB," \
+    "up to ${CONNECTIONS} connections (AsyncRequestWorkerFactor ${HTTPD_ASYNC_REQUEST_WORKER_FACTOR})" >&2
+exec httpd-foreground "$@"
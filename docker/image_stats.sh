@@ -0,0 +1,30 @@
+#!/bin/bash
+# Print the size of an image and the seconds from docker run until it serves the health page,
+# and write both to imagestats.json.
+#
+#   docker/image_stats.sh <image> [health path]
+
+set -eu
+IMAGE="$1"
+HEALTH_PATH="${2:-/health/}"
+TIMEOUT=60
+
+SIZE=$(docker image inspect --format '{{.Size}}' "${IMAGE}")
+
+START=$(date +%s%N)
+CONTAINER=$(docker run -d -p 127.0.0.1::80 "${IMAGE}")
+trap 'docker rm -f "${CONTAINER}" > /dev/null' EXIT
+PORT=$(docker port "${CONTAINER}" 80/tcp | head -n 1 | sed 's/.*://')
+
+until curl -sf -o /dev/null "http://127.0.0.1:${PORT}${HEALTH_PATH}"; do
+    if [ $(( ($(date +%s%N) - START) / 1000000000 )) -ge ${TIMEOUT} ]; then
+        echo "${IMAGE} not healthy after ${TIMEOUT}s" >&2
+        docker logs "${CONTAINER}" >&2
+        exit 1
+    fi
+    sleep 0.1
+done
+HEALTHY_MS=$(( ($(date +%s%N) - START) / 1000000 ))
+
+echo "Image ${IMAGE}: ${SIZE} bytes, healthy after ${HEALTHY_MS} ms"
+echo "{\"image\": \"${IMAGE}\", \"size_bytes\": ${SIZE}, \"start_to_healthy_ms\": ${HEALTHY_MS}}" > imagestats.json
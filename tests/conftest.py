@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts are not packaged, import them from their directories like the buildspec runs them
+for directory in ("tropo", "tools", "docker", "bench"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
@@ -0,0 +1,28 @@
+import os
+
+import build_assets
+
+PAGE = """<html><head><link rel="stylesheet" href="css/site.css"></head>
+<body><script src="js/site.js"></script></body></html>
+"""
+
+
+def test_inlined_stylesheets_are_not_written(tmp_path):
+    src = tmp_path / "src"
+    (src / "css").mkdir(parents=True)
+    (src / "js").mkdir()
+    (src / "index.html").write_text(PAGE)
+    (src / "css" / "site.css").write_text("body { margin: 0; }\n" * 50)
+    (src / "js" / "site.js").write_text("console.log('hello');\n" * 50)
+    dest = tmp_path / "htdocs"
+
+    build_assets.build(str(src), str(dest))
+
+    files = [os.path.relpath(os.path.join(root, name), str(dest))
+             for root, _, names in os.walk(str(dest)) for name in names]
+    assert not [name for name in files if ".css" in name]
+    assert [name for name in files if name.startswith("js/site.") and name.endswith(".js")]
+    html = (dest / "index.html").read_text()
+    assert "<style>body { margin: 0; }" in html
+    assert "css/site" not in html
+    assert "css/site" not in build_assets.file_cache_list(str(dest), "/usr/local/apache2/htdocs")
@@ -0,0 +1,13 @@
+import io
+
+import load_test
+
+PAGE = b"""<html><head><link rel="stylesheet" href="/site.css?v=2"></head><body>
+<img src="logo.png"><img src="/logo.png"><script src="/site.js?v=2"></script><script src="/site.js?v=2"></script>
+<img src="https://example.com/remote.png"><link rel="stylesheet" href="/site.css?v=2">
+</body></html>"""
+
+
+def test_page_view_requests_every_reference_once(monkeypatch):
+    monkeypatch.setattr(load_test.urllib.request, "urlopen", lambda url, timeout: io.BytesIO(PAGE))
+    assert load_test.page_view("http://127.0.0.1:8080/", "/") == ["/", "/site.css?v=2", "/logo.png", "/site.js?v=2"]
@@ -0,0 +1,39 @@
+import pytest
+
+import rightsize
+
+
+def samples(cpu, memory, tasks=3, timestamps=10):
+    return [
+        {"timestamp": str(timestamp), "task": str(task), "cpu": cpu, "memory": memory}
+        for timestamp in range(timestamps)
+        for task in range(tasks)
+    ]
+
+
+def test_idle_service_keeps_a_cpu_share_and_memory_reservation():
+    result = rightsize.recommend(samples(0.0, 0.0), 0.25, 0.6, 3, 2048, 7680)
+    parameters = result["parameters"]
+    assert parameters["ContainerCpu"] == str(rightsize.CPU_STEP)
+    assert parameters["ContainerMemoryReservation"] == str(rightsize.MEMORY_STEP)
+    assert parameters["ContainerMemory"] == str(rightsize.MEMORY_STEP)
+    assert result["tasks_per_instance"] == 2048 // rightsize.CPU_STEP
+
+
+def test_idle_csv_export(tmp_path, capsys):
+    path = tmp_path / "idle.csv"
+    path.write_text("Timestamp,TaskId,CpuUtilized,MemoryUtilized\n" +
+                    "".join("%d,task-%d,0,0\n" % (timestamp, task) for timestamp in range(5) for task in range(3)))
+    assert rightsize.main([str(path)]) == 0
+    assert "ContainerMemoryReservation   32" in capsys.readouterr().out
+
+
+
+@pytest.mark.parametrize("availability_zones", [2, 3, 4, 6])
+def test_task_counts_are_a_multiple_of_the_availability_zones(availability_zones):
+    result = rightsize.recommend(samples(150.0, 300.0, tasks=5), 0.25, 0.6, 3, 2048, 7680, availability_zones)
+    autoscaling_min = int(result["parameters"]["AutoscalingMin"])
+    autoscaling_max = int(result["parameters"]["AutoscalingMax"])
+    assert autoscaling_min % availability_zones == 0
+    assert autoscaling_max % availability_zones == 0
+    assert autoscaling_max >= autoscaling_min >= 3
@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+import service_hello_world
+
+
+def rendered(config):
+    return json.loads(service_hello_world.dump(service_hello_world.build_template(config).to_dict()))
+
+
+@pytest.mark.parametrize("availability_zones", [["A", "B"], ["A", "B", "C", "D"], ["A", "B", "C", "D", "E", "F"]])
+def test_shipped_schedule_renders_for_any_number_of_availability_zones(availability_zones):
+    config = {
+        "Schedule": service_hello_world.load_schedule(service_hello_world.SCHEDULE_FILE),
+        "AvailabilityZones": availability_zones,
+    }
+    template = rendered(config)
+
+    assert template["Parameters"]["AutoscalingMin"]["Default"] == len(availability_zones)
+    subnets = template["Resources"]["Service"]["Properties"]["NetworkConfiguration"]["Fn::If"][1][
+        "AwsvpcConfiguration"]["Subnets"]
+    assert len(subnets) == len(availability_zones)
+    prod_actions = template["Resources"]["ScalableTarget"]["Properties"]["ScheduledActions"]["Fn::If"][1]
+    assert prod_actions
+    for action in prod_actions:
+        capacity = action["ScalableTargetAction"]
+        assert capacity["MinCapacity"] % len(availability_zones) == 0
+        assert capacity["MaxCapacity"] >= capacity["MinCapacity"]
+
+
+def test_scheduled_capacity_per_az():
+    entries = [{"Name": "Peak", "Schedule": "cron(0 6 * * ? *)", "MinCapacityPerAz": 2, "MaxCapacityPerAz": 3}]
+    action = service_hello_world.scheduled_actions(entries, ["A", "B", "C", "D"])[0].to_dict()
+    assert action["ScalableTargetAction"] == {"MinCapacity": 8, "MaxCapacity": 12}
+
+
+def test_scheduled_min_capacity_has_to_spread_evenly():
+    entries = [{"Name": "Peak", "Schedule": "cron(0 6 * * ? *)", "MinCapacity": 6, "MaxCapacity": 12}]
+    with pytest.raises(ValueError):
+        service_hello_world.scheduled_actions(entries, ["A", "B", "C", "D"])
+
+
+def test_autoscaling_min_override_has_to_spread_evenly():
+    with pytest.raises(ValueError):
+        service_hello_world.build_template({"AvailabilityZones": ["A", "B", "C", "D"],
+                                            "Parameters": {"AutoscalingMin": "3"}})
+
+
+def test_oversized_templates_are_still_recorded_in_the_manifest(tmp_path):
+    config = tmp_path / "UAT-config.json"
+    config.write_text(json.dumps({"Parameters": {}}))
+    output_dir = tmp_path / "build"
+    argv = ["-o", str(output_dir), "--format", "json", "--inline-limit", str(config)]
+
+    assert service_hello_world.main(argv) == 2
+    manifest = json.loads((output_dir / service_hello_world.MANIFEST_FILE).read_text())
+    assert manifest["UAT-config"]["output"] == "UAT-config.template"
+    assert service_hello_world.main(["--check"] + argv) == 2
+    assert service_hello_world.main(["--check", "-o", str(output_dir), "--format", "json", str(config)]) == 0
+
+
+def update_handles(template):
+    return [name for name, resource in template["Resources"].items()
+            if resource["Type"] == "AWS::CloudFormation::WaitConditionHandle"]
+
+
+def test_update_handle_is_deterministic_and_follows_the_config():
+    config = {"Image": {"imagename": "service-hello-world", "imagetag": "abc1234"}}
+    first = update_handles(rendered(config))
+    assert len(first) == 1
+    assert update_handles(rendered(config)) == first
+    assert update_handles(rendered({"Image": {"imagename": "service-hello-world", "imagetag": "def5678"}})) != first
+
+
+def test_unknown_parameter_is_rejected():
+    with pytest.raises(ValueError):
+        service_hello_world.build_template({"Parameters": {"NoSuchParameter": "1"}})
+
+
+def test_invalid_availability_zone_is_rejected():
+    with pytest.raises(ValueError):
+        service_hello_world.build_template({"AvailabilityZones": ["A", "B-1"]})
+
+
+def test_ec2_capacity_provider_cannot_be_mixed_with_fargate():
+    rule = rendered({})["Rules"]["Ec2CapacityProviderWithoutFargate"]
+    assert rule["RuleCondition"] == {"Fn::Not": [{"Fn::Equals": [{"Ref": "Ec2CapacityProvider"}, "NONE"]}]}
+    weights = rule["Assertions"][0]["Assert"]["Fn::And"]
+    assert sorted(weight["Fn::Equals"][0]["Ref"] for weight in weights) == [
+        "FargateBase", "FargateSpotWeight", "FargateWeight"]
+    assert all(weight["Fn::Equals"][1] == "0" for weight in weights)
+
+
+def test_slow_start_duration_rejects_1_to_29_seconds():
+    rule = rendered({})["Rules"]["SlowStartDurationRange"]
+    rejected, parameter = rule["Assertions"][0]["Assert"]["Fn::Not"][0]["Fn::Contains"]
+    assert parameter == {"Ref": "SlowStartDuration"}
+    assert rejected == [str(n) for n in range(1, 30)]
+
+
+def test_descriptions_have_no_substitution_placeholders():
+    # cfn-lint E1029: ${...} outside of a Fn::Sub
+    for name, parameter in rendered({})["Parameters"].items():
+        assert "${" not in parameter.get("Description", ""), name
+
+
+@pytest.mark.parametrize("flag", ["--check", "--force"])
+def test_check_and_force_need_config_files(flag, capsys):
+    with pytest.raises(SystemExit) as error:
+        service_hello_world.main([flag])
+    assert error.value.code == 2
+    assert "need config files" in capsys.readouterr().err
@@ -0,0 +1,92 @@
+"""
+Share of requests for files in httpd's file cache list
+
+Compares the file field of the JSON access log (docker/httpd/logging.conf) with the files the image
+lists for mod_file_cache at startup (file_cache.list, see docker/httpd/file_cache.conf):
+
+    docker run --rm <image> cat conf/service/file_cache.list > file_cache.list
+    aws logs tail <stack name> --since 1h | python tools/file_cache_coverage.py file_cache.list
+
+This is a coverage check of the list: it shows which requested files are missing from it, e.g. after a
+change to build_assets.py. mod_file_cache has no counters, so it cannot show that a request was actually
+served from the cache. Requests for a directory are counted against its DirectoryIndex page.
+
+Log lines may be prefixed, e.g. by the timestamp and stream of aws logs tail, everything before the
+first { is ignored.
+"""
+import argparse
+import fileinput
+import json
+import shlex
+import sys
+from collections import Counter
+
+# DirectoryIndex of docker/httpd.conf
+DIRECTORY_INDEX = "index.html"
+
+
+def listed_files(path):
+    with open(path) as f:
+        return set(shlex.split(line)[1] for line in f if line.strip())
+
+
+def requests(lines):
+    for line in lines:
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            entry = json.loads(line[start:])
+        except ValueError:
+            continue
+        if "file" in entry:
+            yield entry
+
+
+def is_listed(name, listed):
+    """
+    Whether the file, or the index page of a directory, is in the list
+    """
+    return name in listed or name.rstrip("/") + "/" + DIRECTORY_INDEX in listed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the share of requests for files in the file cache list")
+    parser.add_argument("list", help="file_cache.list of the image")
+    parser.add_argument("logs", nargs="*", help="Access log files, stdin when none are given")
+    parser.add_argument("-n", "--top", type=int, default=10, help="Number of unlisted files to show")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    listed = listed_files(args.list)
+    covered = 0
+    unlisted = Counter()
+    for entry in requests(fileinput.input(args.logs)):
+        if is_listed(entry["file"], listed):
+            covered += 1
+        else:
+            unlisted[entry["file"]] += 1
+
+    total = covered + sum(unlisted.values())
+    result = {
+        "requests": total,
+        "listed": covered,
+        "coverage": float(covered) / total if total else None,
+        "top_unlisted": unlisted.most_common(args.top),
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return 0
+
+    if not total:
+        print("No access log entries with a file field found")
+        return 0
+    print("%d requests, %d for files in the file cache list (%.1f%%)" % (total, covered, 100.0 * result["coverage"]))
+    for name, count in result["top_unlisted"]:
+        print("%8d  %s" % (count, name))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Offline right-sizing of the service's task
+
+Reads per-task CPU/memory utilization exported from CloudWatch/Container Insights and recommends
+ContainerCpu, ContainerMemory, ContainerMemoryReservation, AutoscalingMin and AutoscalingMax:
+
+    python tools/rightsize.py --headroom 0.3 task-metrics.csv more-task-metrics.json
+
+Inputs, in CPU units and MiB
+ - CSV with a header, e.g. a Container Insights Logs Insights export: Timestamp, TaskId, CpuUtilized, MemoryUtilized
+ - JSON list of such rows
+ - JSON from aws cloudwatch get-metric-data, one result per task with CpuUtilized/MemoryUtilized in its Id or Label
+Percentages (CPUUtilization/MemoryUtilization of AWS/ECS) are converted with --cpu and --memory, the current sizing.
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+from collections import defaultdict
+
+COLUMNS = {
+    "timestamp": ["timestamp", "time", "@timestamp"],
+    "task": ["taskid", "task", "task_id"],
+    "cpu": ["cpuutilized", "cpu"],
+    "memory": ["memoryutilized", "memory"],
+    "cpu_percent": ["cpuutilization", "cpu_percent"],
+    "memory_percent": ["memoryutilization", "memory_percent"],
+}
+
+CPU_STEP = 32
+MEMORY_STEP = 32
+
+
+def normalize(row, cpu, memory):
+    """
+    A {"timestamp", "task", "cpu", "memory"} sample from an input row, None when it has no usable values
+    """
+    fields = {}
+    for key, value in row.items():
+        for name, aliases in COLUMNS.items():
+            if key.strip().lower() in aliases and value not in (None, ""):
+                fields[name] = value
+    if "cpu_percent" in fields and "cpu" not in fields:
+        fields["cpu"] = float(fields["cpu_percent"]) * cpu / 100.0
+    if "memory_percent" in fields and "memory" not in fields:
+        fields["memory"] = float(fields["memory_percent"]) * memory / 100.0
+    if "cpu" not in fields or "memory" not in fields or "timestamp" not in fields:
+        return None
+    return {
+        "timestamp": str(fields["timestamp"]),
+        "task": str(fields.get("task", "")),
+        "cpu": float(fields["cpu"]),
+        "memory": float(fields["memory"]),
+    }
+
+
+def metric_data_rows(data):
+    """
+    Rows from get-metric-data output: results are matched per task on their Label, falling back to the Id
+    """
+    rows = defaultdict(dict)
+    for result in data.get("MetricDataResults", []):
+        label = result.get("Label") or result.get("Id", "")
+        lowered = label.lower()
+        for name in ("cpu_percent", "memory_percent", "cpu", "memory"):
+            alias = next((alias for alias in COLUMNS[name] if alias in lowered), None)
+            if alias:
+                task = lowered.replace(alias, "").strip(" _-:") or label
+                for timestamp, value in zip(result["Timestamps"], result["Values"]):
+                    rows[(task, timestamp)].update({"task": task, "timestamp": timestamp, name: value})
+                break
+    return list(rows.values())
+
+
+def load(paths, cpu, memory):
+    samples = []
+    for path in paths:
+        with open(path) as f:
+            if path.endswith(".json"):
+                data = json.load(f)
+                rows = metric_data_rows(data) if isinstance(data, dict) else data
+            else:
+                rows = list(csv.DictReader(f))
+        samples.extend(sample for sample in (normalize(row, cpu, memory) for row in rows) if sample)
+    return samples
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile, p in 0-100
+    """
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(p / 100.0 * len(ordered))) - 1)]
+
+
+def round_up(value, step):
+    return int(math.ceil(value / float(step)) * step)
+
+
+def tasks_per_instance(cpu, reservation, instance_cpu, instance_memory):
+    by_cpu = instance_cpu // cpu if cpu else float("inf")
+    return int(min(by_cpu, instance_memory // reservation))
+
+
+def recommend(samples, headroom, target_utilization, min_tasks, instance_cpu, instance_memory, availability_zones=3):
+    cpu_values = [sample["cpu"] for sample in samples]
+    memory_values = [sample["memory"] for sample in samples]
+
+    # An idle service still needs a CPU share and a memory reservation, and the task counts below divide by them
+    cpu = max(CPU_STEP, round_up(percentile(cpu_values, 95) * (1 + headroom), CPU_STEP))
+    reservation = max(MEMORY_STEP, round_up(percentile(memory_values, 95) * (1 + headroom), MEMORY_STEP))
+    # The hard limit only has to survive the worst sample, with the same headroom
+    memory = max(reservation, round_up(max(memory_values) * (1 + headroom), MEMORY_STEP))
+
+    # Service demand per timestamp, in tasks of the recommended size running at the target utilization
+    demand = defaultdict(float)
+    for sample in samples:
+        demand[sample["timestamp"]] += sample["cpu"]
+    tasks = [total / (cpu * target_utilization) for total in demand.values()]
+    # The template only accepts task counts that spread evenly over the AZs
+    autoscaling_min = round_up(max(min_tasks, percentile(tasks, 5)), availability_zones)
+    autoscaling_max = round_up(max(autoscaling_min, max(tasks) * (1 + headroom)), availability_zones)
+
+    return {
+        "samples": len(samples),
+        "tasks_seen": len(set(sample["task"] for sample in samples)),
+        "cpu_p95": percentile(cpu_values, 95),
+        "memory_p95": percentile(memory_values, 95),
+        "memory_max": max(memory_values),
+        "parameters": {
+            "ContainerCpu": str(cpu),
+            "ContainerMemory": str(memory),
+            "ContainerMemoryReservation": str(reservation),
+            "AutoscalingMin": str(autoscaling_min),
+            "AutoscalingMax": str(autoscaling_max),
+        },
+        "tasks_per_instance": tasks_per_instance(cpu, reservation, instance_cpu, instance_memory),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recommend task sizing from exported utilization")
+    parser.add_argument("inputs", nargs="+", help="CSV or JSON exports of per-task utilization")
+    parser.add_argument("--headroom", type=float, default=0.25, help="Spare capacity on top of the observed usage")
+    parser.add_argument("--target-utilization", type=float, default=0.6,
+                        help="Average CPU utilization the service runs at, CpuUtilizationTarget / 100")
+    parser.add_argument("--min-tasks", type=int, default=3, help="Lowest AutoscalingMin, e.g. one task per AZ")
+    parser.add_argument("--availability-zones", type=int, default=3,
+                        help="Number of AZs of the service, task counts are rounded up to a multiple of it")
+    parser.add_argument("--cpu", type=int, default=200, help="Current ContainerCpu, to convert percentages")
+    parser.add_argument("--memory", type=int, default=2048, help="Current ContainerMemory, to convert percentages")
+    parser.add_argument("--memory-reservation", type=int, default=512, help="Current ContainerMemoryReservation")
+    parser.add_argument("--instance-cpu", type=int, default=2048, help="CPU units of a cluster instance")
+    parser.add_argument("--instance-memory", type=int, default=7680, help="MiB of a cluster instance available to ECS")
+    parser.add_argument("--json", action="store_true", help="Print the recommendation as JSON")
+    args = parser.parse_args(argv)
+
+    samples = load(args.inputs, args.cpu, args.memory)
+    if not samples:
+        parser.error("no samples with a timestamp, CPU and memory value found")
+
+    result = recommend(samples, args.headroom, args.target_utilization, args.min_tasks,
+                       args.instance_cpu, args.instance_memory, args.availability_zones)
+    result["current_tasks_per_instance"] = tasks_per_instance(args.cpu, args.memory_reservation,
+                                                              args.instance_cpu, args.instance_memory)
+
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return 0
+
+    print("%d samples from %d tasks, CPU p95 %.1f units, memory p95 %.1f MiB, max %.1f MiB" % (
+        result["samples"], result["tasks_seen"], result["cpu_p95"], result["memory_p95"], result["memory_max"]))
+    for name, value in sorted(result["parameters"].items()):
+        print("%-28s %s" % (name, value))
+    print("Tasks per instance: %d recommended, %d current (%d CPU units, %d MiB per instance; "
+          "the distinctInstance constraint keeps this service at 1)" % (
+              result["tasks_per_instance"], result["current_tasks_per_instance"],
+              args.instance_cpu, args.instance_memory))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
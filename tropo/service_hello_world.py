@@ -0,0 +1,2354 @@
+"""
+CloudFormation template for the ecs-apache service
+
+build_template(config) returns the troposphere Template for one configuration.
+Run as a script to render one or more configurations, see main().
+"""
+from awacs.aws import Action, Allow, Policy, Principal, Statement
+from troposphere import (
+    Template, applicationautoscaling, cloudfront, cloudwatch, cloudformation, ec2, ecs, elasticloadbalancingv2, iam,
+    logs, ssm,
+    And, Condition, Equals, FindInMap, GetAZs, GetAtt, If, ImportValue, Join, Not, Or, Output, Parameter, Ref, Select,
+    Split, Sub
+)
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
+import os
+import sys
+import cfn_flip
+import troposphere
+
+SCHEDULE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "schedule.json")
+# Written by buildconfig.sh in the working directory of the build
+IMAGE_CONFIG_FILE = "imageconfig.json"
+MANIFEST_FILE = "manifest.json"
+
+OUTPUT_FORMATS = ["json", "minified", "yaml"]
+
+# AZ suffixes of the ${NetworkStack}-NatIpPublic<AZ> and task subnet exports, AVAILABILITY_ZONES=A,B,C,D overrides
+DEFAULT_AVAILABILITY_ZONES = ["A", "B", "C"]
+# AutoscalingMin values checked for an even spread over the AZs
+EVEN_SPREAD_MAX_TASKS = 240
+
+
+class DeploymentConfiguration(ecs.DeploymentConfiguration):
+    """
+    DeploymentConfiguration with the blue/green, linear and canary strategies and deployment alarms,
+    which troposphere 2.x does not know yet
+    """
+    props = dict(ecs.DeploymentConfiguration.props, Strategy=(str, False), BakeTimeInMinutes=(int, False),
+                 LinearConfiguration=(dict, False), CanaryConfiguration=(dict, False), Alarms=(dict, False))
+
+
+class LoadBalancer(ecs.LoadBalancer):
+    """
+    Service LoadBalancer with the AdvancedConfiguration of blue/green deployments, which troposphere 2.x
+    does not know yet
+    """
+    props = dict(ecs.LoadBalancer.props, AdvancedConfiguration=(dict, False))
+
+
+class MetricTransformation(logs.MetricTransformation):
+    """
+    MetricTransformation with the Dimensions and Unit properties, which troposphere 2.x does not know yet
+    """
+    props = dict(logs.MetricTransformation.props, Dimensions=(list, False), Unit=(str, False))
+
+
+# CloudFormation limits for TemplateBody and TemplateURL
+INLINE_TEMPLATE_LIMIT = 51200
+S3_TEMPLATE_LIMIT = 1000000
+NEAR_LIMIT_RATIO = 0.9
+
+LATENCY_PERCENTILES = ["p50", "p90", "p99"]
+
+
+def dashboard_body():
+    """
+    CloudWatch dashboard of one service as a Sub string
+
+    The same body is used for every generated service, Sub fills in ${LoadBalancer} and ${TargetGroup}
+    (the full names), ${Cluster}, ${Service} and the alarm threshold and log metric parameters.
+    """
+    target_group = ["LoadBalancer", "${LoadBalancer}", "TargetGroup", "${TargetGroup}"]
+    service = ["ClusterName", "${Cluster}", "ServiceName", "${Service}"]
+
+    def widget(x, y, title, metrics, stat="Sum", **properties):
+        properties.update({
+            "title": title,
+            "metrics": metrics,
+            "stat": stat,
+            "period": 60,
+            "region": "${AWS::Region}",
+            "view": "timeSeries",
+        })
+        return {"type": "metric", "x": x, "y": y, "width": 12, "height": 6, "properties": properties}
+
+    body = json.dumps({
+        "widgets": [
+            # "..." repeats the namespace, metric and dimensions of the line above
+            widget(0, 0, "TargetResponseTime", [
+                ["AWS/ApplicationELB", "TargetResponseTime"] + target_group + [{"stat": LATENCY_PERCENTILES[0]}]
+            ] + [["...", {"stat": p}] for p in LATENCY_PERCENTILES[1:]], stat="p99", annotations={"horizontal": [
+                {"label": "%s alarm" % p, "value": "${Latency%sThreshold}" % p.upper()} for p in LATENCY_PERCENTILES
+            ]}),
+            widget(12, 0, "Requests and target 5XX", [
+                ["AWS/ApplicationELB", "RequestCount"] + target_group,
+                [".", "HTTPCode_Target_5XX_Count", ".", ".", ".", ".", {"yAxis": "right"}],
+            ]),
+            widget(0, 6, "RequestCountPerTarget", [
+                ["AWS/ApplicationELB", "RequestCountPerTarget"] + target_group,
+            ]),
+            widget(12, 6, "Hosts", [
+                ["AWS/ApplicationELB", "HealthyHostCount"] + target_group,
+                [".", "UnHealthyHostCount", ".", ".", ".", "."],
+            ], stat="Minimum"),
+            widget(0, 12, "Service CPU and memory", [
+                ["AWS/ECS", "CPUUtilization"] + service,
+                [".", "MemoryUtilization", ".", ".", ".", "."],
+            ], stat="Average"),
+            widget(12, 12, "Server-side latency (access log)", [
+                ["${LogMetricNamespace}", "RequestLatency", "Service", "${AWS::StackName}",
+                 {"stat": LATENCY_PERCENTILES[0]}]
+            ] + [["...", {"stat": p}] for p in LATENCY_PERCENTILES[1:]], stat="p99"),
+        ]
+    }, sort_keys=True, separators=(",", ":"))
+    # The annotation values are numbers, unquote their placeholders
+    return body.replace('"${Latency', '${Latency').replace('Threshold}"', 'Threshold}')
+
+
+def update_dummy_wch(template, config):
+    """
+    Add a WaitConditionHandle named after a hash of the config (image, parameters, schedule) and the
+    rendered resources, so identical inputs give byte-identical templates and any change updates the stack
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    digest.update(json.dumps(template.to_dict(), sort_keys=True).encode("utf-8"))
+    template.add_resource(cloudformation.WaitConditionHandle(
+        "Update" + digest.hexdigest()[:32]
+    ))
+
+
+def load_schedule(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def scheduled_actions(entries, availability_zones=DEFAULT_AVAILABILITY_ZONES):
+    """
+    ScheduledActions for the ScalableTarget from schedule entries, e.g.
+    [{"Name": "MorningPeak", "Schedule": "cron(30 6 ? * MON-FRI *)", "MinCapacity": 6, "MaxCapacity": 12}]
+     - MinCapacityPerAz/MaxCapacityPerAz instead give the capacity per AZ, multiplied by the number of AZs
+    """
+    actions = []
+    for entry in entries:
+        capacity = {}
+        for key in ("MinCapacity", "MaxCapacity"):
+            if key + "PerAz" in entry:
+                capacity[key] = int(entry[key + "PerAz"]) * len(availability_zones)
+            else:
+                capacity[key] = int(entry[key])
+        if capacity["MinCapacity"] > capacity["MaxCapacity"]:
+            raise ValueError("Scheduled action %s: MinCapacity is greater than MaxCapacity" % entry["Name"])
+        if capacity["MinCapacity"] % len(availability_zones):
+            raise ValueError("Scheduled action %s: MinCapacity does not spread evenly over %d AZs" % (
+                entry["Name"], len(availability_zones)))
+        actions.append(applicationautoscaling.ScheduledAction(
+            ScheduledActionName=entry["Name"],
+            Schedule=entry["Schedule"],
+            ScalableTargetAction=applicationautoscaling.ScalableTargetAction(
+                MinCapacity=capacity["MinCapacity"],
+                MaxCapacity=capacity["MaxCapacity"]
+            )
+        ))
+    return actions or Ref("AWS::NoValue")
+
+
+def build_template(config=None):
+    """
+    Build the service template
+
+    config is a dict with the optional keys
+     - Schedule: scheduled actions per StackEnv, see scheduled_actions()
+     - Parameters: overrides for the parameter defaults, same format as config.json
+     - Image: the image config written by buildconfig.sh, only used for the update token
+     - AvailabilityZones: AZ suffixes of the network stack exports, see DEFAULT_AVAILABILITY_ZONES
+    """
+    config = config or {}
+    t = Template()
+
+    availability_zones = config.get("AvailabilityZones", DEFAULT_AVAILABILITY_ZONES)
+    for az in availability_zones:
+        if not az.isalnum():
+            raise ValueError("Availability zone %r is not a valid export and resource name suffix" % az)
+
+    t.add_description("ecs-apache service")
+
+    # PARAMETERS
+
+    container_name = t.add_parameter(Parameter(
+        "ContainerName",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Container name",
+        Default="NONE"
+    ))
+
+    container_port = t.add_parameter(Parameter(
+        "ContainerPort",
+        Type="Number",
+        Description="Container port",
+        Default=80
+    ))
+
+    ecr = t.add_parameter(Parameter(
+        "Ecr",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="ECR repository",
+        Default="NONE"
+    ))
+
+    family = t.add_parameter(Parameter(
+        "Family",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Task family",
+        Default="NONE"
+    ))
+
+    listener_priority = t.add_parameter(Parameter(
+        "ListenerPriority",
+        Description="Listener Rule Priority, must be unique across listeners",
+        Type="Number",
+        Default=10
+    ))
+
+    alb_stack = t.add_parameter(Parameter(
+        "AlbStack",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="ALB stack name",
+        Default="NONE"
+    ))
+
+    ecs_stack = t.add_parameter(Parameter(
+        "EcsStack",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="ECS stack name",
+        Default="NONE"
+    ))
+
+    network_stack = t.add_parameter(Parameter(
+        "NetworkStack",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Network stack name",
+        Default="NONE"
+    ))
+
+    encrypt_lambda_stack = t.add_parameter(Parameter(
+        "EncryptLambdaStack",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Encrypt Lambda stack name",
+        Default="NONE"
+    ))
+
+    encrypt_lambda_stack_condition = "EncryptLambdaStackCondition"
+    t.add_condition(encrypt_lambda_stack_condition, Not(Equals("", Ref(encrypt_lambda_stack))))
+
+    service_path = t.add_parameter(Parameter(
+        "ServicePath",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Optional: Path portion of the service URL (NONE for empty)",
+        Default="NONE"
+    ))
+
+    service_path_condition = "ServicePathCondition"
+    t.add_condition(service_path_condition, Not(Equals(Ref(service_path), service_path.Default)))
+
+    service_host = t.add_parameter(Parameter(
+        "ServiceHost",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Optional: Hostname for the listener (NONE for empty)",
+        Default="NONE"
+    ))
+
+    service_host_condition = "ServiceHostCondition"
+    t.add_condition(service_host_condition, Not(Equals(Ref(service_host), service_host.Default)))
+
+    certificate_arn = t.add_parameter(Parameter(
+        "CertificateArn",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Optional: When certificate ARN is provided, 443 listener is created on ALB (NONE for none)",
+        Default="NONE"
+    ))
+
+    certificate_arn_condition = "CertificateArnCondition"
+    t.add_condition(certificate_arn_condition, Not(Equals(Ref(certificate_arn), certificate_arn.Default)))
+
+    cdn_enabled = t.add_parameter(Parameter(
+        "CdnEnabled",
+        Type="String",
+        AllowedValues=["true", "false"],
+        Description="Put a CloudFront distribution in front of the ALB listener rules",
+        Default="false"
+    ))
+
+    cdn_enabled_condition = "CdnEnabledCondition"
+    t.add_condition(cdn_enabled_condition, Equals(Ref(cdn_enabled), "true"))
+
+    cdn_https_origin_condition = "CdnHttpsOriginCondition"
+    t.add_condition(cdn_https_origin_condition, And(Condition(cdn_enabled_condition), Condition(certificate_arn_condition)))
+
+    cdn_http_origin_condition = "CdnHttpOriginCondition"
+    t.add_condition(cdn_http_origin_condition,
+                    And(Condition(cdn_enabled_condition), Not(Condition(certificate_arn_condition))))
+
+    cdn_origin_prefix_list = t.add_parameter(Parameter(
+        "CdnOriginPrefixList",
+        AllowedPattern="^(NONE|pl-[0-9a-f]+)$",
+        Type="String",
+        Description="CdnEnabled: ID of the com.amazonaws.global.cloudfront.origin-facing prefix list of the region",
+        Default="NONE"
+    ))
+
+    t.add_rule("CdnRequiresOrigin", {
+        "RuleCondition": Equals(Ref(cdn_enabled), "true"),
+        "Assertions": [
+            {
+                "Assert": Not(Equals(Ref(service_host), service_host.Default)),
+                "AssertDescription": "CloudFront reaches the public ALB through ServiceHost, it has to be set"
+            },
+            {
+                "Assert": Not(Equals(Ref(cdn_origin_prefix_list), cdn_origin_prefix_list.Default)),
+                "AssertDescription": "The ALB security group only admits CloudFront with CdnOriginPrefixList"
+            },
+        ]
+    })
+
+    cdn_price_class = t.add_parameter(Parameter(
+        "CdnPriceClass",
+        Type="String",
+        AllowedValues=["PriceClass_100", "PriceClass_200", "PriceClass_All"],
+        Description="CloudFront price class",
+        Default="PriceClass_100"
+    ))
+
+    cdn_html_ttl = t.add_parameter(Parameter(
+        "CdnHtmlTtl",
+        Type="Number",
+        Description="Seconds CloudFront serves HTML without asking the tasks, fingerprinted assets are cached for a year",
+        # CloudFront rejects the gzip/brotli cache key settings with a MaxTTL of 0
+        MinValue=1,
+        Default=60
+    ))
+
+    autoscaling_max = t.add_parameter(Parameter(
+        "AutoscalingMax",
+        Type="Number",
+        Description="Maximum number of tasks to autoscale",
+        Default=3
+    ))
+
+    autoscaling_min = t.add_parameter(Parameter(
+        "AutoscalingMin",
+        Type="Number",
+        Description="Minimum number of tasks to autoscale",
+        Default=len(availability_zones)
+    ))
+
+    t.add_rule("AutoscalingMinEvenSpread", {
+        "Assertions": [{
+            # Fn::Contains, which troposphere 2.x has no helper for
+            "Assert": {"Fn::Contains": [
+                [str(n) for n in range(0, EVEN_SPREAD_MAX_TASKS + 1, len(availability_zones))], Ref(autoscaling_min)
+            ]},
+            "AssertDescription": "AutoscalingMin has to be a multiple of the %d availability zones, at most %d" % (
+                len(availability_zones), EVEN_SPREAD_MAX_TASKS)
+        }]
+    })
+
+    request_count_target = t.add_parameter(Parameter(
+        "RequestCountTarget",
+        Type="Number",
+        Description="Target number of requests per task per minute (ALBRequestCountPerTarget)",
+        MinValue=1,
+        Default=1000
+    ))
+
+    cpu_utilization_target = t.add_parameter(Parameter(
+        "CpuUtilizationTarget",
+        Type="Number",
+        Description="Target average CPU utilization of the service in percent",
+        MinValue=1,
+        MaxValue=100,
+        Default=60
+    ))
+
+    memory_utilization_target = t.add_parameter(Parameter(
+        "MemoryUtilizationTarget",
+        Type="Number",
+        Description="Target average memory utilization of the service in percent",
+        MinValue=1,
+        MaxValue=100,
+        Default=75
+    ))
+
+    scale_out_cooldown = t.add_parameter(Parameter(
+        "ScaleOutCooldown",
+        Type="Number",
+        Description="Seconds after a scale out activity before another scale out can start",
+        MinValue=0,
+        Default=60
+    ))
+
+    scale_in_cooldown = t.add_parameter(Parameter(
+        "ScaleInCooldown",
+        Type="Number",
+        Description="Seconds after a scale in activity before another scale in can start",
+        MinValue=0,
+        Default=300
+    ))
+
+    disable_scale_in = t.add_parameter(Parameter(
+        "DisableScaleIn",
+        Type="String",
+        AllowedValues=["true", "false"],
+        Description="When true the target tracking policies only scale out",
+        Default="false"
+    ))
+
+    latency_thresholds = {}
+    for percentile, default in zip(LATENCY_PERCENTILES, ["0.2", "0.5", "1.5"]):
+        latency_thresholds[percentile] = t.add_parameter(Parameter(
+            "Latency%sThreshold" % percentile.upper(),
+            Type="Number",
+            Description="Alarm when the %s TargetResponseTime of the target group is above this many seconds" % percentile,
+            MinValue=0,
+            Default=default
+        ))
+
+    target_5xx_rate_threshold = t.add_parameter(Parameter(
+        "Target5xxRateThreshold",
+        Type="Number",
+        Description="Alarm when more than this percentage of the requests get a 5XX from the tasks",
+        MinValue=0,
+        MaxValue=100,
+        Default=1
+    ))
+
+    unhealthy_host_threshold = t.add_parameter(Parameter(
+        "UnhealthyHostThreshold",
+        Type="Number",
+        Description="Alarm when at least this many tasks fail the target group health check",
+        MinValue=1,
+        Default=1
+    ))
+
+    alarm_evaluation_periods = t.add_parameter(Parameter(
+        "AlarmEvaluationPeriods",
+        Type="Number",
+        Description="Consecutive minutes above a threshold before an alarm fires",
+        MinValue=1,
+        Default=3
+    ))
+
+    alarm_topic_arn = t.add_parameter(Parameter(
+        "AlarmTopicArn",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Optional: SNS topic notified when an alarm fires or recovers (NONE for none)",
+        Default="NONE"
+    ))
+
+    log_metric_namespace = t.add_parameter(Parameter(
+        "LogMetricNamespace",
+        AllowedPattern="^[^:]+$",
+        Type="String",
+        Description="CloudWatch namespace of the latency and bytes metrics derived from the access log",
+        Default="Services"
+    ))
+
+    log_retention_days = t.add_parameter(Parameter(
+        "LogRetentionDays",
+        Type="Number",
+        AllowedValues=[1, 3, 5, 7, 14, 30, 60, 90, 120, 150, 180, 365, 400, 545, 731, 1827, 3653],
+        Description="Days the LogGroup keeps the access and error logs",
+        Default=60
+    ))
+
+    log_driver_mode = t.add_parameter(Parameter(
+        "LogDriverMode",
+        Type="String",
+        AllowedValues=["non-blocking", "blocking"],
+        Description="non-blocking drops log lines when the buffer is full, blocking stalls the requests instead",
+        Default="non-blocking"
+    ))
+
+    log_driver_mode_non_blocking = "LogDriverModeNonBlocking"
+    t.add_condition(log_driver_mode_non_blocking, Equals(Ref(log_driver_mode), "non-blocking"))
+
+    log_max_buffer_size = t.add_parameter(Parameter(
+        "LogMaxBufferSize",
+        AllowedPattern="^[0-9]+[kmg]?$",
+        Type="String",
+        Description="Size of the non-blocking log buffer of the container, e.g. 25m",
+        Default="25m"
+    ))
+
+    log_router = t.add_parameter(Parameter(
+        "LogRouter",
+        Type="String",
+        AllowedValues=["awslogs", "firelens"],
+        Description="firelens ships the logs through a Fluent Bit sidecar that batches them",
+        Default="awslogs"
+    ))
+
+    firelens_condition = "FirelensCondition"
+    t.add_condition(firelens_condition, Equals(Ref(log_router), "firelens"))
+
+    fluent_bit_image = t.add_parameter(Parameter(
+        "FluentBitImage",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Image of the Fluent Bit sidecar when LogRouter is firelens",
+        Default="public.ecr.aws/aws-observability/aws-for-fluent-bit:stable"
+    ))
+
+    alarm_topic_arn_condition = "AlarmTopicArnCondition"
+    t.add_condition(alarm_topic_arn_condition, Not(Equals(Ref(alarm_topic_arn), alarm_topic_arn.Default)))
+
+    deployment_maximum_percent = t.add_parameter(Parameter(
+        "DeploymentMaximumPercent",
+        Type="Number",
+        Description="ROLLING: running tasks during a deployment in percent of the desired count, "
+                    "above 100 needs free instances",
+        MinValue=100,
+        MaxValue=200,
+        Default=200
+    ))
+
+    deployment_minimum_healthy_percent = t.add_parameter(Parameter(
+        "DeploymentMinimumHealthyPercent",
+        Type="Number",
+        Description="ROLLING: healthy tasks kept during a deployment in percent of the desired count",
+        MinValue=0,
+        MaxValue=100,
+        Default=50
+    ))
+
+    drain_timeout = t.add_parameter(Parameter(
+        "DrainTimeout",
+        Type="Number",
+        Description="Seconds a stopping task keeps serving: the deregistration delay, then the container StopTimeout "
+                    "within which httpd finishes its requests",
+        MinValue=5,
+        MaxValue=120,
+        Default=30
+    ))
+
+    deployment_circuit_breaker = t.add_parameter(Parameter(
+        "DeploymentCircuitBreaker",
+        Type="String",
+        AllowedValues=["true", "false"],
+        Description="Roll back deployments whose tasks do not become healthy",
+        Default="true"
+    ))
+
+    deployment_alarm_rollback = t.add_parameter(Parameter(
+        "DeploymentAlarmRollback",
+        Type="String",
+        AllowedValues=["true", "false"],
+        Description="Roll a deployment back when the p99 latency or 5XX rate alarm fires during it",
+        Default="true"
+    ))
+
+    deployment_strategy = t.add_parameter(Parameter(
+        "DeploymentStrategy",
+        Type="String",
+        AllowedValues=["ROLLING", "BLUE_GREEN", "LINEAR", "CANARY"],
+        Description="ROLLING replaces tasks, the others start new tasks behind TargetGroup2 and move the traffic to them",
+        Default="ROLLING"
+    ))
+
+    blue_green_condition = "BlueGreenCondition"
+    t.add_condition(blue_green_condition, Not(Equals(Ref(deployment_strategy), "ROLLING")))
+
+    linear_condition = "LinearCondition"
+    t.add_condition(linear_condition, Equals(Ref(deployment_strategy), "LINEAR"))
+
+    canary_condition = "CanaryCondition"
+    t.add_condition(canary_condition, Equals(Ref(deployment_strategy), "CANARY"))
+
+    deployment_bake_time = t.add_parameter(Parameter(
+        "DeploymentBakeTime",
+        Type="Number",
+        Description="Minutes the old tasks are kept after the traffic moved, for fast rollbacks",
+        MinValue=0,
+        MaxValue=1440,
+        Default=5
+    ))
+
+    traffic_shift_percent = t.add_parameter(Parameter(
+        "TrafficShiftPercent",
+        Type="Number",
+        Description="Percent of the traffic moved per LINEAR step (ECS needs at least 3) or by the CANARY",
+        MinValue=3,
+        MaxValue=99,
+        Default=10
+    ))
+
+    traffic_shift_interval = t.add_parameter(Parameter(
+        "TrafficShiftInterval",
+        Type="Number",
+        Description="LINEAR and CANARY: minutes between traffic moves",
+        MinValue=0,
+        MaxValue=1440,
+        Default=1
+    ))
+
+    test_listener_priority = t.add_parameter(Parameter(
+        "TestListenerPriority",
+        Type="Number",
+        Description="Priority of the test listener rule (X-Deployment-Test: true), below ListenerPriority",
+        Default=9
+    ))
+
+    t.add_rule("BlueGreenWithoutHttps", {
+        "RuleCondition": Not(Equals(Ref(deployment_strategy), "ROLLING")),
+        "Assertions": [{
+            "Assert": Equals(Ref(certificate_arn), certificate_arn.Default),
+            "AssertDescription": "Blue/green deployments move one listener rule, they cannot be used with CertificateArn"
+        }]
+    })
+
+    container_cpu = t.add_parameter(Parameter(
+        "ContainerCpu",
+        Type="Number",
+        Description="CPU units reserved for the container (1024 is one vCPU), see tools/rightsize.py",
+        MinValue=0,
+        Default=200
+    ))
+
+    container_memory = t.add_parameter(Parameter(
+        "ContainerMemory",
+        Type="Number",
+        Description="Hard memory limit of the container in MiB, the container is killed above it",
+        MinValue=6,
+        Default=2048
+    ))
+
+    container_memory_reservation = t.add_parameter(Parameter(
+        "ContainerMemoryReservation",
+        Type="Number",
+        Description="Memory in MiB reserved for the container on the instance, what binpacking places on",
+        MinValue=6,
+        Default=512
+    ))
+
+    fargate_task_cpu = t.add_parameter(Parameter(
+        "FargateTaskCpu",
+        Type="String",
+        AllowedValues=["256", "512", "1024", "2048", "4096"],
+        Description="Fargate only: task CPU units, at least ContainerCpu",
+        Default="256"
+    ))
+
+    fargate_task_memory = t.add_parameter(Parameter(
+        "FargateTaskMemory",
+        Type="String",
+        AllowedValues=["512", "1024", "2048", "3072", "4096", "5120", "6144", "7168", "8192"],
+        Description="Fargate only: task memory in MiB, at least ContainerMemory and valid for FargateTaskCpu",
+        Default="2048"
+    ))
+
+    health_check_path = t.add_parameter(Parameter(
+        "HealthCheckPath",
+        Type="String",
+        Description="Healthcheck path",
+        Default="NONE"
+    ))
+
+    health_check_preset = t.add_parameter(Parameter(
+        "HealthCheckPreset",
+        Type="String",
+        AllowedValues=["NONE", "fast"],
+        Description="Optional: Target group health check preset, overrides the settings below (NONE for none)",
+        Default="NONE"
+    ))
+
+    health_check_preset_condition = "HealthCheckPresetCondition"
+    t.add_condition(health_check_preset_condition, Not(Equals(Ref(health_check_preset), health_check_preset.Default)))
+
+    t.add_mapping("HealthCheckPresets", {
+        # A new task takes traffic after HealthyThreshold * Interval seconds
+        "fast": {"Interval": 5, "Timeout": 2, "HealthyThreshold": 2, "UnhealthyThreshold": 2},
+    })
+
+    health_check_interval = t.add_parameter(Parameter(
+        "HealthCheckIntervalSeconds",
+        Type="Number",
+        Description="Seconds between target group health checks",
+        MinValue=5,
+        MaxValue=300,
+        Default=30
+    ))
+
+    health_check_timeout = t.add_parameter(Parameter(
+        "HealthCheckTimeoutSeconds",
+        Type="Number",
+        Description="Seconds before a target group health check fails, less than the interval",
+        MinValue=2,
+        MaxValue=120,
+        Default=10
+    ))
+
+    healthy_threshold = t.add_parameter(Parameter(
+        "HealthyThresholdCount",
+        Type="Number",
+        Description="Successful health checks before a task takes traffic",
+        MinValue=2,
+        MaxValue=10,
+        Default=4
+    ))
+
+    unhealthy_threshold = t.add_parameter(Parameter(
+        "UnhealthyThresholdCount",
+        Type="Number",
+        Description="Failed health checks before a task stops taking traffic",
+        MinValue=2,
+        MaxValue=10,
+        Default=3
+    ))
+
+    def health_check_setting(name, parameter):
+        return If(
+            health_check_preset_condition,
+            FindInMap("HealthCheckPresets", Ref(health_check_preset), name),
+            Ref(parameter)
+        )
+
+    slow_start_duration = t.add_parameter(Parameter(
+        "SlowStartDuration",
+        Type="Number",
+        Description="Seconds a new task ramps up to its full share of requests, 30-900 (0 to disable). "
+                    "Not supported with least_outstanding_requests, where it is ignored",
+        MinValue=0,
+        MaxValue=900,
+        Default=0
+    ))
+
+    t.add_rule("SlowStartDurationRange", {
+        "Assertions": [{
+            # Fn::Contains, which troposphere 2.x has no helper for
+            "Assert": Not({"Fn::Contains": [[str(n) for n in range(1, 30)], Ref(slow_start_duration)]}),
+            "AssertDescription": "SlowStartDuration has to be 0 or 30-900 seconds"
+        }]
+    })
+
+    load_balancing_algorithm = t.add_parameter(Parameter(
+        "LoadBalancingAlgorithm",
+        Type="String",
+        AllowedValues=["round_robin", "least_outstanding_requests"],
+        Description="How the ALB picks a task, least_outstanding_requests avoids piling requests onto slow tasks",
+        Default="round_robin"
+    ))
+
+    least_outstanding_requests_condition = "LeastOutstandingRequestsCondition"
+    t.add_condition(least_outstanding_requests_condition,
+                    Equals(Ref(load_balancing_algorithm), "least_outstanding_requests"))
+
+    stickiness_enabled = t.add_parameter(Parameter(
+        "StickinessEnabled",
+        Type="String",
+        AllowedValues=["true", "false"],
+        Description="Route a client to the same task with an ALB cookie",
+        Default="false"
+    ))
+
+    stickiness_duration = t.add_parameter(Parameter(
+        "StickinessDuration",
+        Type="Number",
+        Description="Seconds the stickiness cookie is valid",
+        MinValue=1,
+        MaxValue=604800,
+        Default=86400
+    ))
+
+    target_keep_alive_timeout = t.add_parameter(Parameter(
+        "TargetKeepAliveTimeout",
+        Type="Number",
+        Description="httpd KeepAliveTimeout, keep it above the ALB idle timeout so the ALB closes idle connections",
+        MinValue=1,
+        Default=65
+    ))
+
+    nofile_limit = t.add_parameter(Parameter(
+        "NofileLimit",
+        Type="Number",
+        Description="Open files (soft and hard nofile ulimit) of the container, each connection takes one",
+        MinValue=1024,
+        MaxValue=1048576,
+        Default=65536
+    ))
+
+    somaxconn = t.add_parameter(Parameter(
+        "Somaxconn",
+        Type="Number",
+        Description="net.core.somaxconn of the container and httpd's ListenBacklog, connections waiting to be accepted",
+        MinValue=128,
+        MaxValue=65535,
+        Default=4096
+    ))
+
+    tcp_tw_reuse = t.add_parameter(Parameter(
+        "TcpTwReuse",
+        Type="String",
+        AllowedValues=["0", "1", "2"],
+        Description="net.ipv4.tcp_tw_reuse of the container, 1 reuses TIME_WAIT sockets for outgoing connections",
+        Default="1"
+    ))
+
+    network_mode = t.add_parameter(Parameter(
+        "NetworkMode",
+        Type="String",
+        AllowedValues=["bridge", "awsvpc"],
+        Description="bridge: dynamic host ports behind docker NAT, awsvpc: an ENI and IP target per task",
+        Default="bridge"
+    ))
+
+    awsvpc_condition = "AwsvpcCondition"
+    t.add_condition(awsvpc_condition, Equals(Ref(network_mode), "awsvpc"))
+
+    task_subnet_export = t.add_parameter(Parameter(
+        "TaskSubnetExport",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="awsvpc only: NetworkStack export of the task subnets, imported as <NetworkStack>-<this><AZ>",
+        Default="SubnetPrivate"
+    ))
+
+    ec2_capacity_provider = t.add_parameter(Parameter(
+        "Ec2CapacityProvider",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Optional: EC2 capacity provider of the cluster to place tasks with, EXPORTED for "
+                    "the <EcsStack>-CapacityProvider export (NONE for none)",
+        Default="NONE"
+    ))
+
+    ec2_capacity_provider_base = t.add_parameter(Parameter(
+        "Ec2CapacityProviderBase",
+        Type="Number",
+        Description="Tasks always placed on the EC2 capacity provider",
+        MinValue=0,
+        Default=0
+    ))
+
+    ec2_capacity_provider_weight = t.add_parameter(Parameter(
+        "Ec2CapacityProviderWeight",
+        Type="Number",
+        Description="Relative share of the tasks above the base placed on the EC2 capacity provider",
+        MinValue=0,
+        Default=1
+    ))
+
+    fargate_base = t.add_parameter(Parameter(
+        "FargateBase",
+        Type="Number",
+        Description="Tasks always placed on FARGATE",
+        MinValue=0,
+        Default=0
+    ))
+
+    fargate_weight = t.add_parameter(Parameter(
+        "FargateWeight",
+        Type="Number",
+        Description="Relative share of the tasks placed on FARGATE (0 to not use FARGATE)",
+        MinValue=0,
+        Default=0
+    ))
+
+    fargate_spot_weight = t.add_parameter(Parameter(
+        "FargateSpotWeight",
+        Type="Number",
+        Description="Relative share of the tasks placed on FARGATE_SPOT (0 to not use FARGATE_SPOT)",
+        MinValue=0,
+        Default=0
+    ))
+
+    ec2_capacity_provider_condition = "Ec2CapacityProviderCondition"
+    t.add_condition(ec2_capacity_provider_condition,
+                    Not(Equals(Ref(ec2_capacity_provider), ec2_capacity_provider.Default)))
+
+    exported_capacity_provider_condition = "ExportedCapacityProviderCondition"
+    t.add_condition(exported_capacity_provider_condition, Equals(Ref(ec2_capacity_provider), "EXPORTED"))
+
+    fargate_condition = "FargateCondition"
+    t.add_condition(fargate_condition, Or(Not(Equals(Ref(fargate_weight), "0")), Not(Equals(Ref(fargate_base), "0"))))
+
+    fargate_spot_condition = "FargateSpotCondition"
+    t.add_condition(fargate_spot_condition, Not(Equals(Ref(fargate_spot_weight), "0")))
+
+    any_fargate_condition = "AnyFargateCondition"
+    t.add_condition(any_fargate_condition, Or(Condition(fargate_condition), Condition(fargate_spot_condition)))
+
+    capacity_provider_strategy_condition = "CapacityProviderStrategyCondition"
+    t.add_condition(capacity_provider_strategy_condition, Or(
+        Condition(ec2_capacity_provider_condition),
+        Condition(any_fargate_condition)
+    ))
+
+    t.add_rule("FargateRequiresAwsvpc", {
+        "RuleCondition": Or(Not(Equals(Ref(fargate_weight), "0")), Not(Equals(Ref(fargate_base), "0")),
+                            Not(Equals(Ref(fargate_spot_weight), "0"))),
+        "Assertions": [{
+            "Assert": Equals(Ref(network_mode), "awsvpc"),
+            "AssertDescription": "FARGATE and FARGATE_SPOT tasks require NetworkMode awsvpc"
+        }]
+    })
+
+    t.add_rule("Ec2CapacityProviderWithoutFargate", {
+        "RuleCondition": Not(Equals(Ref(ec2_capacity_provider), ec2_capacity_provider.Default)),
+        "Assertions": [{
+            "Assert": And(Equals(Ref(fargate_weight), "0"), Equals(Ref(fargate_base), "0"),
+                          Equals(Ref(fargate_spot_weight), "0")),
+            "AssertDescription": "A capacity provider strategy cannot mix an EC2 capacity provider with FARGATE or "
+                                 "FARGATE_SPOT"
+        }]
+    })
+
+    container_health_check_interval = t.add_parameter(Parameter(
+        "ContainerHealthCheckInterval",
+        Type="Number",
+        Description="Seconds between container health checks of the health path",
+        MinValue=5,
+        MaxValue=300,
+        Default=10
+    ))
+
+    container_health_check_start_period = t.add_parameter(Parameter(
+        "ContainerHealthCheckStartPeriod",
+        Type="Number",
+        Description="Seconds after start before failed container health checks count",
+        MinValue=0,
+        MaxValue=300,
+        Default=10
+    ))
+
+    stack_env = t.add_parameter(Parameter(
+        "StackEnv",
+        Type="String",
+        AllowedValues=["PROD", "UAT", "OTHER"],
+        Description="When PROD is selected dsaas will be installed on the instances. Use UAT for UAT stacks and OTHER for everything else",
+        Default="OTHER"
+    ))
+
+    is_prod = "IsProd"
+    t.add_condition(is_prod, Equals("PROD", Ref(stack_env)))
+
+    is_uat = "IsUat"
+    t.add_condition(is_uat, Equals("UAT", Ref(stack_env)))
+
+    # Defined in imageconfig.conf
+
+    image_name = t.add_parameter(Parameter(
+        "ImageName",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Docker image name",
+        Default="NONE"
+    ))
+
+    image_tag = t.add_parameter(Parameter(
+        "ImageTag",
+        AllowedPattern="^.+$",
+        Type="String",
+        Description="Docker image tag",
+        Default="NONE"
+    ))
+
+    # METADATA
+
+    t.add_metadata({
+        'AWS::CloudFormation::Interface': {
+            'ParameterGroups': [
+                {
+                    'Label': {
+                        'default': 'Container',
+                    },
+                    'Parameters': [
+                        container_name.title,
+                        container_port.title,
+                        family.title,
+                        ecr.title,
+                        image_name.title,
+                        image_tag.title,
+                        service_path.title,
+                        service_host.title,
+                        health_check_path.title,
+                        health_check_preset.title,
+                        health_check_interval.title,
+                        health_check_timeout.title,
+                        healthy_threshold.title,
+                        unhealthy_threshold.title,
+                        slow_start_duration.title,
+                        load_balancing_algorithm.title,
+                        stickiness_enabled.title,
+                        stickiness_duration.title,
+                        target_keep_alive_timeout.title,
+                        nofile_limit.title,
+                        somaxconn.title,
+                        tcp_tw_reuse.title,
+                        container_health_check_interval.title,
+                        container_health_check_start_period.title,
+                        autoscaling_max.title,
+                        autoscaling_min.title,
+                        listener_priority.title,
+                        container_cpu.title,
+                        container_memory.title,
+                        container_memory_reservation.title,
+                        fargate_task_cpu.title,
+                        fargate_task_memory.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'Dependent stacks',
+                    },
+                    'Parameters': [
+                        alb_stack.title,
+                        encrypt_lambda_stack.title,
+                        ecs_stack.title,
+                        network_stack.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'Optional',
+                    },
+                    'Parameters': [
+                        certificate_arn.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'Network',
+                    },
+                    'Parameters': [
+                        network_mode.title,
+                        task_subnet_export.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'Capacity providers',
+                    },
+                    'Parameters': [
+                        ec2_capacity_provider.title,
+                        ec2_capacity_provider_base.title,
+                        ec2_capacity_provider_weight.title,
+                        fargate_base.title,
+                        fargate_weight.title,
+                        fargate_spot_weight.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'CDN',
+                    },
+                    'Parameters': [
+                        cdn_enabled.title,
+                        cdn_origin_prefix_list.title,
+                        cdn_price_class.title,
+                        cdn_html_ttl.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'Autoscaling',
+                    },
+                    'Parameters': [
+                        request_count_target.title,
+                        cpu_utilization_target.title,
+                        memory_utilization_target.title,
+                        scale_out_cooldown.title,
+                        scale_in_cooldown.title,
+                        disable_scale_in.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'Alarms',
+                    },
+                    'Parameters': [latency_thresholds[p].title for p in LATENCY_PERCENTILES] + [
+                        target_5xx_rate_threshold.title,
+                        unhealthy_host_threshold.title,
+                        alarm_evaluation_periods.title,
+                        alarm_topic_arn.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'Deployment',
+                    },
+                    'Parameters': [
+                        deployment_maximum_percent.title,
+                        deployment_minimum_healthy_percent.title,
+                        drain_timeout.title,
+                        deployment_circuit_breaker.title,
+                        deployment_alarm_rollback.title,
+                        deployment_strategy.title,
+                        deployment_bake_time.title,
+                        traffic_shift_percent.title,
+                        traffic_shift_interval.title,
+                        test_listener_priority.title,
+                    ]
+                },
+                {
+                    'Label': {
+                        'default': 'Logging',
+                    },
+                    'Parameters': [
+                        log_metric_namespace.title,
+                        log_retention_days.title,
+                        log_driver_mode.title,
+                        log_max_buffer_size.title,
+                        log_router.title,
+                        fluent_bit_image.title,
+                    ]
+                },
+            ]
+        }
+    })
+
+    log_group = t.add_resource(logs.LogGroup(
+        "LogGroup",
+        LogGroupName=Ref("AWS::StackName"),
+        RetentionInDays=Ref(log_retention_days)
+    ))
+
+    """
+    Metrics from the JSON access log of docker/httpd/logging.conf
+     - Latency of all requests per service, and latency and bytes per route of the successful ones
+     - Only requests below 400 are counted per route, so unknown paths do not create dimensions
+    """
+    def log_metric(title, metric_name, value, unit, filter_pattern, dimensions):
+        return logs.MetricFilter(
+            title,
+            LogGroupName=Ref(log_group),
+            FilterPattern=filter_pattern,
+            MetricTransformations=[MetricTransformation(
+                MetricNamespace=Ref(log_metric_namespace),
+                MetricName=metric_name,
+                MetricValue=value,
+                Unit=unit,
+                Dimensions=[{"Key": key, "Value": "$." + field} for key, field in dimensions],
+            )],
+        )
+
+    request_latency_metric = t.add_resource(log_metric(
+        "RequestLatencyMetricFilter",
+        "RequestLatency",
+        "$.duration_us",
+        "Microseconds",
+        "{ $.duration_us = * }",
+        [("Service", "service")],
+    ))
+
+    route_latency_metric = t.add_resource(log_metric(
+        "RouteLatencyMetricFilter",
+        "RouteLatency",
+        "$.duration_us",
+        "Microseconds",
+        "{ $.status < 400 }",
+        [("Service", "service"), ("Route", "route")],
+    ))
+
+    route_bytes_metric = t.add_resource(log_metric(
+        "RouteBytesMetricFilter",
+        "RouteBytes",
+        "$.bytes",
+        "Bytes",
+        "{ $.status < 400 }",
+        [("Service", "service"), ("Route", "route")],
+    ))
+
+    # ROLES
+
+    task_role = t.add_resource(iam.Role(
+        "TaskRole",
+        AssumeRolePolicyDocument=Policy(
+            Version="2012-10-17",
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Principal=Principal("Service", "ecs-tasks.amazonaws.com"),
+                    Action=[Action("sts", "AssumeRole")]
+                )
+            ]
+        ),
+        Path="/",
+        Policies=[
+            # The Fluent Bit sidecar ships the logs with the task role, awslogs uses the instance or execution role.
+            # The stack owns the LogGroup, Fluent Bit only creates streams in it.
+            If(firelens_condition, iam.Policy(
+                PolicyName=Join("-", [Ref("AWS::StackName"), "TaskPolicy"]),
+                PolicyDocument=Policy(
+                    Version="2012-10-17",
+                    Statement=[
+                        Statement(
+                            Effect=Allow,
+                            Action=[
+                                Action("logs", "CreateLogStream"),
+                                Action("logs", "DescribeLogStreams"),
+                                Action("logs", "PutLogEvents"),
+                            ],
+                            Resource=[
+                                Join(
+                                    ":",
+                                    [
+                                        "arn:aws:logs",
+                                        Ref("AWS::Region"),
+                                        Ref("AWS::AccountId"),
+                                        "log-group", Ref(log_group), "*"
+                                    ]
+                                )
+                            ]
+                        )
+                    ]
+                )
+            ), Ref("AWS::NoValue"))
+        ]
+    ))
+
+    # Attach a policy with attach_ssm_policy that allows listing and reading of parameters from ParameterStore
+    # If we have any encrypted variables, attach a policy to allow using the KMS Key exported by EncryptLambdaStack
+    # PR's welcome
+
+    service_role = t.add_resource(iam.Role(
+        "ServiceRole",
+        AssumeRolePolicyDocument=Policy(
+            Version="2012-10-17",
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Principal=Principal("Service", "ecs.amazonaws.com"),
+                    Action=[Action("sts", "AssumeRole")]
+                )
+            ]
+        ),
+        Path="/",
+        Policies=[
+            iam.Policy(
+                PolicyName=Join("-", [Ref("AWS::StackName"), "ServicePolicy"]),
+                PolicyDocument=Policy(
+                    Version="2012-10-17",
+                    Statement=[
+                        Statement(
+                            Effect=Allow,
+                            Action=[
+                                Action("ec2", "AuthorizeSecurityGroupIngress"),
+                                Action("ec2", "Describe*"),
+                                Action("elasticloadbalancing", "DeregisterInstancesFromLoadBalancer"),
+                                Action("elasticloadbalancing", "DeregisterTargets"),
+                                Action("elasticloadbalancing", "Describe*"),
+                                Action("elasticloadbalancing", "RegisterInstancesWithLoadBalancer"),
+                                Action("elasticloadbalancing", "RegisterTargets"),
+                            ],
+                            Resource=[
+                                "*"
+                            ]
+                        ),
+                        Statement(
+                            Effect=Allow,
+                            Action=[
+                                Action("logs", "CreateLogStream"),
+                                Action("logs", "PutLogEvents"),
+                                Action("logs", "CreateLogGroup"),
+                            ],
+                            Resource=[
+                                Join(
+                                    ":",
+                                    [
+                                        "arn:aws:logs",
+                                        Ref("AWS::Region"),
+                                        Ref("AWS::AccountId"),
+                                        "log-group", Ref(log_group), "*"
+                                    ]
+                                )
+                            ]
+                        ),
+                        # Statement(
+                        #    Effect=Allow,
+                        #    Action=[
+                        #        Action("cloudwatch", "*")
+                        #        ],
+                        #    Resource=[
+                        #        "*"
+                        #    ]
+                        # )
+                    ]
+                )
+            )
+        ]
+
+    ))
+
+    autoscale_role = t.add_resource(iam.Role(
+        "AutoscaleRole",
+        AssumeRolePolicyDocument=Policy(
+            Version="2012-10-17",
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Principal=Principal("Service", "application-autoscaling.amazonaws.com"),
+                    Action=[Action("sts", "AssumeRole")]
+                )
+            ]
+        ),
+        Path="/",
+        Policies=[
+            iam.Policy(
+                PolicyName=Join("-", [Ref("AWS::StackName"), "AutoScalePolicy"]),
+                PolicyDocument=Policy(
+                    Version="2012-10-17",
+                    Statement=[
+                        Statement(
+                            Effect=Allow,
+                            Action=[
+                                Action("ecs", "DescribeServices"),
+                                Action("ecs", "UpdateService"),
+                            ],
+                            Resource=["*"]
+                        ),
+                        Statement(
+                            Effect=Allow,
+                            Action=[
+                                Action("cloudwatch", "DescribeAlarms"),
+                                Action("cloudwatch", "PutMetricAlarm"),
+                                Action("cloudwatch", "DeleteAlarms"),
+                            ],
+                            Resource=["*"]
+                        )
+                    ],
+                )
+            )
+        ]
+
+    ))
+
+    """
+    Create a TargetGroup to be attached to ALB of the ECS-stack
+    """
+    target_group = t.add_resource(elasticloadbalancingv2.TargetGroup(
+        "TargetGroup1",
+        Port=Ref(container_port),
+        Protocol="HTTP",
+        TargetType=If(awsvpc_condition, "ip", "instance"),
+        HealthCheckPath=Ref(health_check_path),
+        HealthCheckIntervalSeconds=health_check_setting("Interval", health_check_interval),
+        HealthCheckProtocol="HTTP",
+        HealthCheckTimeoutSeconds=health_check_setting("Timeout", health_check_timeout),
+        HealthyThresholdCount=health_check_setting("HealthyThreshold", healthy_threshold),
+        Matcher=elasticloadbalancingv2.Matcher(HttpCode="200,302"),
+        UnhealthyThresholdCount=health_check_setting("UnhealthyThreshold", unhealthy_threshold),
+        VpcId=ImportValue(Sub("${NetworkStack}-Vpc")),
+        TargetGroupAttributes=[
+            elasticloadbalancingv2.TargetGroupAttribute(
+                Key="deregistration_delay.timeout_seconds",
+                Value=Ref(drain_timeout),
+            ),
+            elasticloadbalancingv2.TargetGroupAttribute(
+                Key="slow_start.duration_seconds",
+                Value=If(least_outstanding_requests_condition, "0", Ref(slow_start_duration)),
+            ),
+            elasticloadbalancingv2.TargetGroupAttribute(
+                Key="load_balancing.algorithm.type",
+                Value=Ref(load_balancing_algorithm),
+            ),
+            elasticloadbalancingv2.TargetGroupAttribute(
+                Key="stickiness.enabled",
+                Value=Ref(stickiness_enabled),
+            ),
+            elasticloadbalancingv2.TargetGroupAttribute(
+                Key="stickiness.type",
+                Value="lb_cookie",
+            ),
+            elasticloadbalancingv2.TargetGroupAttribute(
+                Key="stickiness.lb_cookie.duration_seconds",
+                Value=Ref(stickiness_duration),
+            ),
+        ],
+        Tags=[{
+            "Key": "TargetGroupName",
+            "Value": Join("", ["Tg-", Ref(container_name)])
+        }]
+    ))
+
+    """
+    Blue/green deployments start the new tasks behind TargetGroup2 and move ListenerRule1 over to it,
+    the next deployment moves it back
+    """
+    target_group2 = t.add_resource(elasticloadbalancingv2.TargetGroup(
+        "TargetGroup2",
+        Condition=blue_green_condition,
+        **dict(target_group.properties)
+    ))
+
+    """
+    Task definition
+    """
+    """
+    Fargate pulls the image and ships the logs with the execution role, EC2 tasks use the instance role
+    """
+    execution_role = t.add_resource(iam.Role(
+        "ExecutionRole",
+        Condition=any_fargate_condition,
+        AssumeRolePolicyDocument=Policy(
+            Version="2012-10-17",
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Principal=Principal("Service", "ecs-tasks.amazonaws.com"),
+                    Action=[Action("sts", "AssumeRole")]
+                )
+            ]
+        ),
+        Path="/",
+        ManagedPolicyArns=["arn:aws:iam::aws:policy/service-role/AmazonECSTaskExecutionRolePolicy"],
+    ))
+
+    task_definition = t.add_resource(ecs.TaskDefinition(
+        "TaskDefinition",
+        DependsOn=log_group.title,
+        TaskRoleArn=GetAtt(task_role, "Arn"),
+        ExecutionRoleArn=If(any_fargate_condition, GetAtt(execution_role, "Arn"), Ref("AWS::NoValue")),
+        NetworkMode=Ref(network_mode),
+        RequiresCompatibilities=If(any_fargate_condition, ["EC2", "FARGATE"], Ref("AWS::NoValue")),
+        # Fargate needs task level sizing
+        Cpu=If(any_fargate_condition, Ref(fargate_task_cpu), Ref("AWS::NoValue")),
+        Memory=If(any_fargate_condition, Ref(fargate_task_memory), Ref("AWS::NoValue")),
+        Family=Ref(family),
+        ContainerDefinitions=[
+            ecs.ContainerDefinition(
+                LogConfiguration=If(
+                    firelens_condition,
+                    # The container writes to the local Fluent Bit, which buffers while CloudWatch Logs is slow.
+                    # log_key sends the access log line as is, the metric filters parse it.
+                    ecs.LogConfiguration(
+                        LogDriver="awsfirelens",
+                        Options={
+                            "Name": "cloudwatch_logs",
+                            "region": Ref("AWS::Region"),
+                            "log_group_name": Ref("AWS::StackName"),
+                            "log_stream_prefix": Join("", [Ref(container_name), "/"]),
+                            "auto_create_group": "false",
+                            "log_key": "log",
+                        }
+                    ),
+                    ecs.LogConfiguration(
+                        LogDriver="awslogs",
+                        Options={
+                            "awslogs-group": Ref("AWS::StackName"),
+                            "awslogs-region": Ref("AWS::Region"),
+                            "awslogs-stream-prefix": Ref(container_name),
+                            "mode": Ref(log_driver_mode),
+                            "max-buffer-size": If(log_driver_mode_non_blocking, Ref(log_max_buffer_size),
+                                                  Ref("AWS::NoValue")),
+                        }
+                    )
+                ),
+                DependsOn=If(
+                    firelens_condition,
+                    [ecs.ContainerDependency(ContainerName="log_router", Condition="START")],
+                    Ref("AWS::NoValue")
+                ),
+                Memory=Ref(container_memory),
+                PortMappings=[
+                    ecs.PortMapping(
+                        # Dynamic host port in bridge mode, awsvpc requires the container port
+                        HostPort=If(awsvpc_condition, Ref("AWS::NoValue"), 0),
+                        ContainerPort=Ref(container_port),
+                        Protocol="tcp"
+                    ),
+                ],
+                Essential=True,
+                # Command=[
+                #     "/usr/sbin/apache2ctl",
+                #     "-D",
+                #     "FOREGROUND"
+                # ],
+                Name=Ref(container_name),
+                Image=Join("", [
+                    Ref(ecr), "/",
+                    Ref(image_name), ":",
+                    Ref(image_tag)
+                ]),
+                Cpu=Ref(container_cpu),
+                MemoryReservation=Ref(container_memory_reservation),
+                # The image stops httpd gracefully, docker/httpd-start.sh ends it before the StopTimeout
+                StopTimeout=Ref(drain_timeout),
+                Ulimits=[
+                    ecs.Ulimit(
+                        Name="nofile",
+                        SoftLimit=Ref(nofile_limit),
+                        HardLimit=Ref(nofile_limit)
+                    ),
+                ],
+                # Namespaced per task in bridge and awsvpc mode
+                SystemControls=[
+                    ecs.SystemControl(
+                        Namespace="net.core.somaxconn",
+                        Value=Ref(somaxconn)
+                    ),
+                    ecs.SystemControl(
+                        Namespace="net.ipv4.tcp_tw_reuse",
+                        Value=Ref(tcp_tw_reuse)
+                    ),
+                ],
+                # busybox wget of the alpine image, it fails on anything but a 2XX after redirects
+                HealthCheck=ecs.HealthCheck(
+                    Command=[
+                        "CMD", "wget", "-q", "-O", "/dev/null",
+                        Join("", ["http://127.0.0.1:", Ref(container_port), Ref(health_check_path)])
+                    ],
+                    Interval=Ref(container_health_check_interval),
+                    Timeout=5,
+                    Retries=3,
+                    StartPeriod=Ref(container_health_check_start_period),
+                ),
+                Environment=[
+                    ecs.Environment(
+                        Name="AWSStackName",
+                        Value=Ref("AWS::StackName")
+                    ),
+                    ecs.Environment(
+                        Name="AWSRegion",
+                        Value=Ref("AWS::Region")
+                    ),
+                    ecs.Environment(
+                        Name="ALB",
+                        Value=ImportValue(Sub("${AlbStack}-AlbPrivateDNSName"))
+                    ),
+                    ecs.Environment(
+                        Name="KEEPALIVE_TIMEOUT",
+                        Value=Ref(target_keep_alive_timeout)
+                    ),
+                    ecs.Environment(
+                        Name="LISTEN_BACKLOG",
+                        Value=Ref(somaxconn)
+                    ),
+                    ecs.Environment(
+                        Name="DRAIN_TIMEOUT",
+                        Value=Ref(drain_timeout)
+                    ),
+                    # docker/httpd-start.sh sizes the httpd worker pool from these
+                    ecs.Environment(
+                        Name="CONTAINER_CPU",
+                        Value=Ref(container_cpu)
+                    ),
+                    ecs.Environment(
+                        Name="CONTAINER_MEMORY_RESERVATION",
+                        Value=Ref(container_memory_reservation)
+                    ),
+                ],
+            ),
+            If(firelens_condition, ecs.ContainerDefinition(
+                Name="log_router",
+                Image=Ref(fluent_bit_image),
+                Essential=True,
+                FirelensConfiguration=ecs.FirelensConfiguration(
+                    Type="fluentbit",
+                    # The metadata fields would be dropped by log_key anyway
+                    Options={"enable-ecs-log-metadata": "false"},
+                ),
+                MemoryReservation=50,
+                LogConfiguration=ecs.LogConfiguration(
+                    LogDriver="awslogs",
+                    Options={
+                        "awslogs-group": Ref("AWS::StackName"),
+                        "awslogs-region": Ref("AWS::Region"),
+                        "awslogs-stream-prefix": "firelens",
+                        "mode": "non-blocking",
+                    }
+                ),
+            ), Ref("AWS::NoValue")),
+        ],
+    ))
+
+    """
+    Add the TargetGroup to a Listener on the ALB
+     - path-pattern is given as a Parameter to this stack
+    """
+    listener_rule1 = t.add_resource(elasticloadbalancingv2.ListenerRule(
+        "ListenerRule1",
+        Actions=[
+            elasticloadbalancingv2.Action(
+                TargetGroupArn=Ref(target_group),
+                Type="forward"
+            )
+        ],
+        Conditions=[
+            If(service_path_condition,
+               elasticloadbalancingv2.Condition(
+                   Field="path-pattern",
+                   Values=[
+                       Ref(service_path),
+                   ]
+               ),
+               Ref("AWS::NoValue")
+               ),
+            If(service_host_condition,
+               elasticloadbalancingv2.Condition(
+                   Field="host-header",
+                   Values=[
+                       Ref(service_host),
+                   ]
+               ),
+               Ref("AWS::NoValue")
+               ),
+        ],
+        ListenerArn=ImportValue(Sub("${AlbStack}-AlbPublicListener80")),
+        Priority=Ref(listener_priority)
+    ))
+
+    test_listener_rule = t.add_resource(elasticloadbalancingv2.ListenerRule(
+        "TestListenerRule",
+        Condition=blue_green_condition,
+        Actions=[
+            elasticloadbalancingv2.Action(
+                TargetGroupArn=Ref(target_group),
+                Type="forward"
+            )
+        ],
+        Conditions=listener_rule1.Conditions + [
+            elasticloadbalancingv2.Condition(
+                Field="http-header",
+                HttpHeaderConfig=elasticloadbalancingv2.HttpHeaderConfig(
+                    HttpHeaderName="X-Deployment-Test",
+                    Values=["true"]
+                )
+            ),
+        ],
+        ListenerArn=ImportValue(Sub("${AlbStack}-AlbPublicListener80")),
+        Priority=Ref(test_listener_priority)
+    ))
+
+    """
+    ECS moves the listener rules between the target groups with this role
+    """
+    blue_green_role = t.add_resource(iam.Role(
+        "BlueGreenRole",
+        Condition=blue_green_condition,
+        AssumeRolePolicyDocument=Policy(
+            Version="2012-10-17",
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Principal=Principal("Service", "ecs.amazonaws.com"),
+                    Action=[Action("sts", "AssumeRole")]
+                )
+            ]
+        ),
+        Path="/",
+        ManagedPolicyArns=["arn:aws:iam::aws:policy/AmazonECSInfrastructureRolePolicyForLoadBalancers"],
+    ))
+
+    listener_rule2 = t.add_resource(elasticloadbalancingv2.ListenerRule(
+        "ListenerRule2",
+        Condition=certificate_arn_condition,
+        Actions=[
+            elasticloadbalancingv2.Action(
+                TargetGroupArn=Ref(target_group),
+                Type="forward"
+            )
+        ],
+        Conditions=[
+            If(service_path_condition,
+               elasticloadbalancingv2.Condition(
+                   Field="path-pattern",
+                   Values=[
+                       Ref(service_path),
+                   ]
+               ),
+               Ref("AWS::NoValue")
+               ),
+            If(service_host_condition,
+               elasticloadbalancingv2.Condition(
+                   Field="host-header",
+                   Values=[
+                       Ref(service_host),
+                   ]
+               ),
+               Ref("AWS::NoValue")
+               ),
+        ],
+        ListenerArn=ImportValue(Sub("${AlbStack}-AlbPublicListener443")),
+        Priority=Ref(listener_priority)
+    ))
+
+    # Allow NAT instances to access Public ALB, one rule per AZ
+    sg_alb_public_ingress_rules = {}
+    sg_alb_public_ingress_rules443 = {}
+    for az in availability_zones:
+        sg_alb_public_ingress_rules[az] = t.add_resource(
+            ec2.SecurityGroupIngress(
+                "ApacheIngressRule" + az,
+                CidrIp=Join("/", [ImportValue(Sub("${NetworkStack}-NatIpPublic" + az)), "32"]),
+                IpProtocol="6",
+                FromPort=80,
+                ToPort=80,
+                GroupId=ImportValue(Sub("${AlbStack}-SgAlbPublicGroupId"))
+            ),
+        )
+        sg_alb_public_ingress_rules443[az] = t.add_resource(
+            ec2.SecurityGroupIngress(
+                "ApacheIngressRuleSsl" + az,
+                Condition=certificate_arn_condition,
+                CidrIp=Join("/", [ImportValue(Sub("${NetworkStack}-NatIpPublic" + az)), "32"]),
+                IpProtocol="6",
+                FromPort=443,
+                ToPort=443,
+                GroupId=ImportValue(Sub("${AlbStack}-SgAlbPublicGroupId"))
+            )
+        )
+
+    """
+    Optional CloudFront distribution with the ALB as origin
+     - The origin is ServiceHost, so the host-header listener rule matches
+     - The ALB security group admits the CloudFront origin-facing prefix list on the origin port
+     - Fingerprinted assets (see docker/build_assets.py) are cached for a year, HTML for CdnHtmlTtl
+     - Nothing but the path reaches the origin: no headers, cookies or query strings
+    """
+    cdn_static_extensions = ["*.png", "*.webp", "*.avif", "*.css", "*.js"]
+
+    def cdn_cache_policy(title, min_ttl, default_ttl, max_ttl):
+        return cloudfront.CachePolicy(
+            title,
+            Condition=cdn_enabled_condition,
+            CachePolicyConfig=cloudfront.CachePolicyConfig(
+                Name=Join("-", [Ref("AWS::StackName"), title]),
+                MinTTL=min_ttl,
+                DefaultTTL=default_ttl,
+                MaxTTL=max_ttl,
+                ParametersInCacheKeyAndForwardedToOrigin=cloudfront.ParametersInCacheKeyAndForwardedToOrigin(
+                    CookiesConfig=cloudfront.CacheCookiesConfig(CookieBehavior="none"),
+                    HeadersConfig=cloudfront.CacheHeadersConfig(HeaderBehavior="none"),
+                    QueryStringsConfig=cloudfront.CacheQueryStringsConfig(QueryStringBehavior="none"),
+                    EnableAcceptEncodingGzip=True,
+                    EnableAcceptEncodingBrotli=True,
+                ),
+            ),
+        )
+
+    cdn_static_cache_policy = t.add_resource(cdn_cache_policy("CdnStaticCachePolicy", 86400, 31536000, 31536000))
+
+    cdn_html_cache_policy = t.add_resource(cdn_cache_policy(
+        "CdnHtmlCachePolicy", Ref(cdn_html_ttl), Ref(cdn_html_ttl), Ref(cdn_html_ttl)
+    ))
+
+    cdn_origin_request_policy = t.add_resource(cloudfront.OriginRequestPolicy(
+        "CdnOriginRequestPolicy",
+        Condition=cdn_enabled_condition,
+        OriginRequestPolicyConfig=cloudfront.OriginRequestPolicyConfig(
+            Name=Join("-", [Ref("AWS::StackName"), "CdnOriginRequestPolicy"]),
+            CookiesConfig=cloudfront.OriginRequestCookiesConfig(CookieBehavior="none"),
+            HeadersConfig=cloudfront.OriginRequestHeadersConfig(HeaderBehavior="none"),
+            QueryStringsConfig=cloudfront.OriginRequestQueryStringsConfig(QueryStringBehavior="none"),
+        ),
+    ))
+
+    cdn_origin_id = "Alb"
+
+    distribution = t.add_resource(cloudfront.Distribution(
+        "Distribution",
+        Condition=cdn_enabled_condition,
+        DistributionConfig=cloudfront.DistributionConfig(
+            Comment=Ref("AWS::StackName"),
+            Enabled=True,
+            HttpVersion="http2",
+            IPV6Enabled=True,
+            PriceClass=Ref(cdn_price_class),
+            Origins=[
+                cloudfront.Origin(
+                    Id=cdn_origin_id,
+                    DomainName=Ref(service_host),
+                    CustomOriginConfig=cloudfront.CustomOriginConfig(
+                        OriginProtocolPolicy=If(cdn_https_origin_condition, "https-only", "http-only"),
+                        OriginSSLProtocols=["TLSv1.2"],
+                    ),
+                ),
+            ],
+            DefaultCacheBehavior=cloudfront.DefaultCacheBehavior(
+                TargetOriginId=cdn_origin_id,
+                ViewerProtocolPolicy="redirect-to-https",
+                Compress=True,
+                CachePolicyId=Ref(cdn_html_cache_policy),
+                OriginRequestPolicyId=Ref(cdn_origin_request_policy),
+            ),
+            CacheBehaviors=[
+                cloudfront.CacheBehavior(
+                    PathPattern=extension,
+                    TargetOriginId=cdn_origin_id,
+                    ViewerProtocolPolicy="redirect-to-https",
+                    Compress=True,
+                    CachePolicyId=Ref(cdn_static_cache_policy),
+                    OriginRequestPolicyId=Ref(cdn_origin_request_policy),
+                ) for extension in cdn_static_extensions
+            ],
+        ),
+    ))
+
+    for title, port, condition in [("CdnIngressRule", 80, cdn_http_origin_condition),
+                                   ("CdnIngressRuleSsl", 443, cdn_https_origin_condition)]:
+        t.add_resource(ec2.SecurityGroupIngress(
+            title,
+            Condition=condition,
+            SourcePrefixListId=Ref(cdn_origin_prefix_list),
+            IpProtocol="6",
+            FromPort=port,
+            ToPort=port,
+            GroupId=ImportValue(Sub("${AlbStack}-SgAlbPublicGroupId"))
+        ))
+
+    t.add_output(Output(
+        "DistributionDomainName",
+        Condition=cdn_enabled_condition,
+        Description="CloudFront domain name of the service",
+        Value=GetAtt(distribution, "DomainName")
+    ))
+
+    """
+    Security group of the tasks in awsvpc mode, only the ALB reaches the container port
+    """
+    task_security_group = t.add_resource(ec2.SecurityGroup(
+        "TaskSecurityGroup",
+        Condition=awsvpc_condition,
+        GroupDescription=Join(" ", [Ref("AWS::StackName"), "tasks"]),
+        VpcId=ImportValue(Sub("${NetworkStack}-Vpc")),
+        SecurityGroupIngress=[
+            ec2.SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort=Ref(container_port),
+                ToPort=Ref(container_port),
+                SourceSecurityGroupId=ImportValue(Sub("${AlbStack}-SgAlbPublicGroupId"))
+            ),
+        ],
+    ))
+
+    """
+    Service definition
+     - Spread to several AZs for HA
+     - Binpack to minimize number of required hosts per AZ
+     - Placement strategies and constraints only apply to EC2, they are left out when Fargate is in the strategy
+     - No DesiredCount: autoscaling owns the task count, a stack update would reset it to the minimum and undo
+       any scale-out. A new service starts with one task, below AutoscalingMin until a scale-out alarm fires
+    """
+    service = t.add_resource(ecs.Service(
+        "Service",
+        Cluster=ImportValue(Sub("${EcsStack}-Cluster")),
+        DependsOn=service_role,
+        CapacityProviderStrategy=If(
+            capacity_provider_strategy_condition,
+            [
+                If(
+                    ec2_capacity_provider_condition,
+                    ecs.CapacityProviderStrategyItem(
+                        # The cluster stack owns the capacity providers of the cluster and their managed scaling
+                        CapacityProvider=If(
+                            exported_capacity_provider_condition,
+                            ImportValue(Sub("${EcsStack}-CapacityProvider")),
+                            Ref(ec2_capacity_provider)
+                        ),
+                        Base=Ref(ec2_capacity_provider_base),
+                        Weight=Ref(ec2_capacity_provider_weight)
+                    ),
+                    Ref("AWS::NoValue")
+                ),
+                If(
+                    fargate_condition,
+                    ecs.CapacityProviderStrategyItem(
+                        CapacityProvider="FARGATE",
+                        Base=Ref(fargate_base),
+                        Weight=Ref(fargate_weight)
+                    ),
+                    Ref("AWS::NoValue")
+                ),
+                If(
+                    fargate_spot_condition,
+                    ecs.CapacityProviderStrategyItem(
+                        CapacityProvider="FARGATE_SPOT",
+                        Weight=Ref(fargate_spot_weight)
+                    ),
+                    Ref("AWS::NoValue")
+                ),
+            ],
+            Ref("AWS::NoValue")
+        ),
+        LoadBalancers=[
+            LoadBalancer(
+                ContainerName=Ref(container_name),
+                ContainerPort=Ref(container_port),
+                TargetGroupArn=Ref(target_group),
+                AdvancedConfiguration=If(
+                    blue_green_condition,
+                    {
+                        "AlternateTargetGroupArn": Ref(target_group2),
+                        "ProductionListenerRule": Ref(listener_rule1),
+                        "TestListenerRule": Ref(test_listener_rule),
+                        "RoleArn": GetAtt(blue_green_role, "Arn"),
+                    },
+                    Ref("AWS::NoValue")
+                )
+            ),
+        ],
+        PlacementStrategies=If(
+            any_fargate_condition,
+            Ref("AWS::NoValue"),
+            [
+                ecs.PlacementStrategy(
+                    Type="spread",
+                    Field="attribute:ecs.availability-zone"
+                ),
+                ecs.PlacementStrategy(
+                    Type="binpack",
+                    Field="memory"
+                ),
+            ]
+        ),
+        # awsvpc services use the ECS service-linked role and cannot be given one
+        Role=If(awsvpc_condition, Ref("AWS::NoValue"), Ref(service_role)),
+        NetworkConfiguration=If(
+            awsvpc_condition,
+            ecs.NetworkConfiguration(
+                AwsvpcConfiguration=ecs.AwsvpcConfiguration(
+                    AssignPublicIp="DISABLED",
+                    SecurityGroups=[Ref(task_security_group)],
+                    Subnets=[ImportValue(Sub("${NetworkStack}-${TaskSubnetExport}" + az)) for az in availability_zones],
+                )
+            ),
+            Ref("AWS::NoValue")
+        ),
+        TaskDefinition=Ref(task_definition),
+        DeploymentConfiguration=DeploymentConfiguration(
+            MaximumPercent=Ref(deployment_maximum_percent),
+            MinimumHealthyPercent=Ref(deployment_minimum_healthy_percent),
+            DeploymentCircuitBreaker=ecs.DeploymentCircuitBreaker(
+                Enable=Ref(deployment_circuit_breaker),
+                Rollback=Ref(deployment_circuit_breaker)
+            ),
+            # The alarms are defined with the dashboard below
+            Alarms={
+                "AlarmNames": [Ref("LatencyP99Alarm"), Ref("Target5xxRateAlarm")],
+                "Enable": Ref(deployment_alarm_rollback),
+                "Rollback": Ref(deployment_alarm_rollback),
+            },
+            Strategy=Ref(deployment_strategy),
+            BakeTimeInMinutes=If(blue_green_condition, Ref(deployment_bake_time), Ref("AWS::NoValue")),
+            LinearConfiguration=If(linear_condition, {
+                "StepPercent": Ref(traffic_shift_percent),
+                "StepBakeTimeInMinutes": Ref(traffic_shift_interval),
+            }, Ref("AWS::NoValue")),
+            CanaryConfiguration=If(canary_condition, {
+                "CanaryPercent": Ref(traffic_shift_percent),
+                "CanaryBakeTimeInMinutes": Ref(traffic_shift_interval),
+            }, Ref("AWS::NoValue")),
+        ),
+        PlacementConstraints=If(
+            any_fargate_condition,
+            Ref("AWS::NoValue"),
+            [
+                ecs.PlacementConstraint(
+                    Type="distinctInstance"
+                )
+            ]
+        ),
+    ))
+
+    """
+    Scheduled actions
+     - Pre-warm capacity ahead of known traffic peaks, per StackEnv
+    """
+    schedule = config.get("Schedule", {})
+
+    """
+    Make the service a ScalableTarget
+    """
+    scalable_target = t.add_resource(applicationautoscaling.ScalableTarget(
+        "ScalableTarget",
+        MaxCapacity=Ref(autoscaling_max),
+        MinCapacity=Ref(autoscaling_min),
+        ResourceId=Join("/", [
+            "service",
+            ImportValue(Sub("${EcsStack}-Cluster")),
+            GetAtt(service, "Name")
+        ]),
+        RoleARN=GetAtt(autoscale_role, "Arn"),
+        ScalableDimension="ecs:service:DesiredCount",
+        ServiceNamespace="ecs",
+        ScheduledActions=If(
+            is_prod,
+            scheduled_actions(schedule.get("PROD", []), availability_zones),
+            If(
+                is_uat,
+                scheduled_actions(schedule.get("UAT", []), availability_zones),
+                Ref("AWS::NoValue")
+            )
+        ),
+    ))
+
+    """
+    Target tracking policies
+     - Request count per target scales out before queueing latency builds up
+     - CPU and memory utilization guard against expensive requests
+     - The policy asking for the most capacity wins, scale in only when all agree
+    """
+    # The ALB full name (app/<name>/<id>) is the middle part of the imported listener ARN
+    alb_listener_arn_parts = Split("/", ImportValue(Sub("${AlbStack}-AlbPublicListener80")))
+    alb_full_name = Sub("app/${Name}/${Id}", {
+        "Name": Select(2, alb_listener_arn_parts),
+        "Id": Select(3, alb_listener_arn_parts),
+    })
+
+    def target_tracking_policy(title, metric_type, target_value, resource_label=None, **kwargs):
+        return applicationautoscaling.ScalingPolicy(
+            title,
+            PolicyName=Join("-", [Ref("AWS::StackName"), title]),
+            PolicyType="TargetTrackingScaling",
+            ScalingTargetId=Ref(scalable_target),
+            TargetTrackingScalingPolicyConfiguration=applicationautoscaling.TargetTrackingScalingPolicyConfiguration(
+                PredefinedMetricSpecification=applicationautoscaling.PredefinedMetricSpecification(
+                    PredefinedMetricType=metric_type,
+                    ResourceLabel=resource_label or Ref("AWS::NoValue")
+                ),
+                TargetValue=Ref(target_value),
+                ScaleInCooldown=Ref(scale_in_cooldown),
+                ScaleOutCooldown=Ref(scale_out_cooldown),
+                DisableScaleIn=Ref(disable_scale_in),
+            ),
+            **kwargs
+        )
+
+    service_request_count_policy = t.add_resource(target_tracking_policy(
+        "ServiceRequestCountPolicy",
+        "ALBRequestCountPerTarget",
+        request_count_target,
+        # The target group must be attached to the ALB before its request count is published
+        DependsOn=listener_rule1.title,
+        resource_label=Join("/", [alb_full_name, GetAtt(target_group, "TargetGroupFullName")])
+    ))
+
+    service_cpu_policy = t.add_resource(target_tracking_policy(
+        "ServiceCpuPolicy",
+        "ECSServiceAverageCPUUtilization",
+        cpu_utilization_target
+    ))
+
+    service_memory_policy = t.add_resource(target_tracking_policy(
+        "ServiceMemoryPolicy",
+        "ECSServiceAverageMemoryUtilization",
+        memory_utilization_target
+    ))
+
+    """
+    Dashboard and alarms
+     - Latency percentiles, 5XX rate and unhealthy hosts of TargetGroup1 on the imported ALB
+     - Percentile alarms ignore periods with too few requests for the percentile to mean anything
+    """
+    target_group_dimensions = [
+        cloudwatch.MetricDimension(Name="LoadBalancer", Value=alb_full_name),
+        cloudwatch.MetricDimension(Name="TargetGroup", Value=GetAtt(target_group, "TargetGroupFullName")),
+    ]
+    alarm_actions = If(alarm_topic_arn_condition, [Ref(alarm_topic_arn)], Ref("AWS::NoValue"))
+
+    def alarm(title, description, threshold, comparison="GreaterThanThreshold", **kwargs):
+        return cloudwatch.Alarm(
+            title,
+            AlarmDescription=Join(" ", [Ref("AWS::StackName"), description]),
+            ComparisonOperator=comparison,
+            EvaluationPeriods=Ref(alarm_evaluation_periods),
+            Threshold=Ref(threshold),
+            TreatMissingData="notBreaching",
+            AlarmActions=alarm_actions,
+            OKActions=alarm_actions,
+            **kwargs
+        )
+
+    latency_alarms = [t.add_resource(alarm(
+        "Latency%sAlarm" % percentile.upper(),
+        "%s TargetResponseTime" % percentile,
+        latency_thresholds[percentile],
+        Namespace="AWS/ApplicationELB",
+        MetricName="TargetResponseTime",
+        Dimensions=target_group_dimensions,
+        ExtendedStatistic=percentile,
+        EvaluateLowSampleCountPercentile="ignore",
+        Period=60,
+    )) for percentile in LATENCY_PERCENTILES]
+
+    def target_group_metric(query_id, metric_name):
+        return cloudwatch.MetricDataQuery(
+            Id=query_id,
+            MetricStat=cloudwatch.MetricStat(
+                Metric=cloudwatch.Metric(
+                    Namespace="AWS/ApplicationELB",
+                    MetricName=metric_name,
+                    Dimensions=target_group_dimensions,
+                ),
+                Period=60,
+                Stat="Sum",
+            ),
+            ReturnData=False,
+        )
+
+    target_5xx_alarm = t.add_resource(alarm(
+        "Target5xxRateAlarm",
+        "percentage of target 5XX responses",
+        target_5xx_rate_threshold,
+        Metrics=[
+            target_group_metric("errors", "HTTPCode_Target_5XX_Count"),
+            target_group_metric("requests", "RequestCount"),
+            cloudwatch.MetricDataQuery(
+                Id="rate",
+                Expression="100 * FILL(errors, 0) / requests",
+                Label="Target 5XX rate",
+                ReturnData=True,
+            ),
+        ],
+    ))
+
+    unhealthy_host_alarm = t.add_resource(alarm(
+        "UnhealthyHostAlarm",
+        "tasks failing the target group health check",
+        unhealthy_host_threshold,
+        comparison="GreaterThanOrEqualToThreshold",
+        Namespace="AWS/ApplicationELB",
+        MetricName="UnHealthyHostCount",
+        Dimensions=target_group_dimensions,
+        Statistic="Maximum",
+        Period=60,
+    ))
+
+    dashboard = t.add_resource(cloudwatch.Dashboard(
+        "Dashboard",
+        DashboardName=Ref("AWS::StackName"),
+        DashboardBody=Sub(dashboard_body(), {
+            "LoadBalancer": alb_full_name,
+            "TargetGroup": GetAtt(target_group, "TargetGroupFullName"),
+            "Cluster": ImportValue(Sub("${EcsStack}-Cluster")),
+            "Service": GetAtt(service, "Name"),
+        }),
+    ))
+
+    t.add_output(Output(
+        "DashboardUrl",
+        Description="CloudWatch dashboard of the service",
+        Value=Sub("https://console.aws.amazon.com/cloudwatch/home?region=${AWS::Region}#dashboards:name=${Dashboard}"),
+    ))
+
+    for name, value in config.get("Parameters", {}).items():
+        if name not in t.parameters:
+            raise ValueError("Unknown parameter %s" % name)
+        t.parameters[name].Default = value
+    # Fail the render instead of the AutoscalingMinEvenSpread rule at deploy time
+    if int(autoscaling_min.Default) % len(availability_zones):
+        raise ValueError("AutoscalingMin %s does not spread evenly over %d AZs" % (
+            autoscaling_min.Default, len(availability_zones)))
+
+    update_dummy_wch(t, config)
+
+    return t
+
+
+def dump(data, output_format="json"):
+    """
+    Serialize a template dict
+     - json: indented like Template.to_json()
+     - minified: JSON without whitespace
+     - yaml: YAML with short form intrinsic functions
+    """
+    if output_format == "minified":
+        return json.dumps(data, sort_keys=True, separators=(",", ":"))
+    body = json.dumps(data, indent=4, sort_keys=True, separators=(",", ": "))
+    if output_format == "yaml":
+        return cfn_flip.to_yaml(body, clean_up=True)
+    return body
+
+
+def size_report(template, output_format="json"):
+    """
+    Bytes per template section and per resource, largest first, flagging templates near the CloudFormation limits
+    """
+    data = template.to_dict()
+    total = len(dump(data, output_format).encode("utf-8"))
+    sizes = []
+    for section, value in data.items():
+        if section == "Resources":
+            continue
+        sizes.append((section, len(dump({section: value}, output_format).encode("utf-8"))))
+    for title, resource in data.get("Resources", {}).items():
+        sizes.append((title, len(dump({title: resource}, output_format).encode("utf-8"))))
+
+    lines = ["%-40s %8d bytes" % ("Total (%s)" % output_format, total)]
+    for limit, name in [(INLINE_TEMPLATE_LIMIT, "inline"), (S3_TEMPLATE_LIMIT, "S3")]:
+        if total > limit:
+            lines.append("OVER the %s template limit of %d bytes" % (name, limit))
+        elif total > limit * NEAR_LIMIT_RATIO:
+            lines.append("NEAR the %s template limit of %d bytes (%d%%)" % (name, limit, 100 * total // limit))
+    for name, size in sorted(sizes, key=lambda item: -item[1]):
+        lines.append("  %-38s %8d bytes" % (name, size))
+    return lines
+
+
+def input_hash(config, output_format="json"):
+    """
+    Hash of everything that goes into a rendered template: the config, the output format, this module and troposphere
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    digest.update(output_format.encode("utf-8"))
+    with open(os.path.abspath(__file__), "rb") as f:
+        digest.update(f.read())
+    digest.update(troposphere.__version__.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def default_config():
+    config = {"Schedule": load_schedule(SCHEDULE_FILE)}
+    if os.environ.get("AVAILABILITY_ZONES"):
+        config["AvailabilityZones"] = os.environ["AVAILABILITY_ZONES"].split(",")
+    if os.path.exists(IMAGE_CONFIG_FILE):
+        with open(IMAGE_CONFIG_FILE) as f:
+            config["Image"] = json.load(f)
+    return config
+
+
+def load_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    for key, value in default_config().items():
+        config.setdefault(key, value)
+    return config
+
+
+def render(job):
+    """
+    Render one config file, job is a (config path, output path, output format, size report) tuple
+     - The template is only written when an output path is given
+     - Returns the sha256 and the size in bytes of the rendered template and the size report lines
+    """
+    config_path, output_path, output_format, report = job
+    template = build_template(load_config(config_path))
+    body = dump(template.to_dict(), output_format)
+    if output_path:
+        with open(output_path, "w") as f:
+            f.write(body)
+    lines = size_report(template, output_format) if report else []
+    return hashlib.sha256(body.encode("utf-8")).hexdigest(), len(body.encode("utf-8")), lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the ecs-apache service template")
+    parser.add_argument("configs", nargs="*", help="Config files, e.g. UAT-config.json. "
+                                                   "Without any the default template is printed to stdout")
+    parser.add_argument("-o", "--output-dir", default=".", help="Directory for <config name>.template files")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("-f", "--force", action="store_true", help="Render configs even when their inputs are unchanged")
+    parser.add_argument("--check", action="store_true",
+                        help="Only compare the rendered templates with the manifest and report changed/unchanged, "
+                             "exits 1 when any template changed")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json", help="Output format")
+    parser.add_argument("--size-report", action="store_true", help="Print bytes per resource to stderr")
+    parser.add_argument("--inline-limit", action="store_true",
+                        help="Exit 2 when a template is over the %d byte inline template limit" % INLINE_TEMPLATE_LIMIT)
+    args = parser.parse_args(argv)
+
+    if not args.configs:
+        # The manifest is kept per config file, the default template printed to stdout has none
+        if args.check or args.force:
+            parser.error("--check and --force need config files, the default template has no manifest entry")
+        template = build_template(default_config())
+        body = dump(template.to_dict(), args.format)
+        print(body)
+        if args.size_report:
+            print("\n".join(size_report(template, args.format)), file=sys.stderr)
+        if args.inline_limit and len(body.encode("utf-8")) > INLINE_TEMPLATE_LIMIT:
+            print("template is over the inline template limit of %d bytes" % INLINE_TEMPLATE_LIMIT, file=sys.stderr)
+            return 2
+        return 0
+
+    names = [os.path.splitext(os.path.basename(path))[0] for path in args.configs]
+    if len(set(names)) != len(names):
+        parser.error("config file names must be unique, they name the output files")
+
+    if not args.check and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    manifest_path = os.path.join(args.output_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    jobs = []
+    hashes = {}
+    for name, path in zip(names, args.configs):
+        output_path = os.path.join(args.output_dir, name + ".template")
+        if args.check:
+            jobs.append((path, None, args.format, args.size_report))
+            continue
+        hashes[name] = input_hash(load_config(path), args.format)
+        if not args.force and os.path.exists(output_path) and manifest.get(name, {}).get("inputs") == hashes[name]:
+            print("%s: inputs unchanged, skipped" % path, file=sys.stderr)
+            continue
+        jobs.append((path, output_path, args.format, args.size_report))
+
+    if args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(render, jobs))
+    else:
+        results = [render(job) for job in jobs]
+
+    changed = False
+    oversized = False
+    for (path, output_path, _, _), (template_hash, size, report) in zip(jobs, results):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if report:
+            print("\n".join(["%s:" % path] + report), file=sys.stderr)
+        if args.inline_limit and size > INLINE_TEMPLATE_LIMIT:
+            print("%s: over the inline template limit of %d bytes" % (path, INLINE_TEMPLATE_LIMIT), file=sys.stderr)
+            oversized = True
+        state = "unchanged" if manifest.get(name, {}).get("template") == template_hash else "changed"
+        changed = changed or state == "changed"
+        if args.check:
+            print("%s: %s" % (name, state))
+            continue
+        manifest[name] = {
+            "inputs": hashes[name],
+            "output": os.path.basename(output_path),
+            "template": template_hash,
+        }
+        print("%s: rendered %s, template %s" % (path, output_path, state), file=sys.stderr)
+
+    if args.check:
+        return 2 if oversized else 1 if changed else 0
+
+    # Written even for oversized templates, it has to match the .template files on disk
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return 2 if oversized else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())